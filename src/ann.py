@@ -0,0 +1,272 @@
+"""Pure-NumPy inverted-file (IVF) index with optional product quantization.
+
+The coarse quantizer is a spherical k-means over the normalized gallery.
+Each row is filed under its nearest centroid; at query time only the
+``nprobe`` closest lists are scored. With ``pq_m > 0`` the residuals are
+product-quantized into ``pq_m`` one-byte codes and scored with lookup
+tables, optionally re-ranked exactly against the float32 gallery.
+"""
+
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import numpy as np
+
+INDEX_PATH = Path.cwd() / "models" / "offender_index.npz"
+PQ_CENTROIDS = 256  # one byte per sub-vector code
+MAX_TRAIN = 100_000  # rows sampled for k-means training
+_ASSIGN_CHUNK = 65_536
+
+
+def default_n_lists(n: int) -> int:
+    """Rule-of-thumb list count (~4 * sqrt(N)) for a gallery of ``n`` rows."""
+    return max(1, min(n, int(4 * np.sqrt(n))))
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, spherical: bool) -> np.ndarray:
+    """Nearest centroid per row (max inner product, or min L2 distance)."""
+    bias = None if spherical else -0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), _ASSIGN_CHUNK):
+        sims = x[start : start + _ASSIGN_CHUNK] @ centroids.T
+        if bias is not None:
+            sims += bias
+        out[start : start + _ASSIGN_CHUNK] = sims.argmax(axis=1)
+    return out
+
+
+def _kmeans(
+    x: np.ndarray, k: int, n_iter: int, rng: np.random.Generator, spherical: bool
+) -> np.ndarray:
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _assign(x, centroids, spherical)
+        counts = np.bincount(assign, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+        if spherical:
+            centroids /= np.maximum(
+                np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12
+            )
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file index over a row-normalized float32 gallery matrix."""
+
+    def __init__(self, n_lists: int, pq_m: int = 0):
+        self.n_lists = n_lists
+        self.pq_m = pq_m
+        self.centroids: np.ndarray | None = None
+        self.codebooks: np.ndarray | None = None  # (pq_m, 256, dim // pq_m)
+        self.list_offsets = np.zeros(1, dtype=np.int64)
+        self.list_rows = np.zeros(0, dtype=np.int64)
+        self.codes: np.ndarray | None = None  # (N, pq_m) uint8, in list order
+        self.ids_digest = ""  # gallery.ids_digest of the rows it was built on
+
+    def __len__(self) -> int:
+        return len(self.list_rows)
+
+    def build(
+        self, matrix: np.ndarray, ids_digest: str = "", n_iter: int = 20, seed: int = 0
+    ):
+        """Train the quantizers on ``matrix`` and file every row."""
+        rng = np.random.default_rng(seed)
+        x = np.ascontiguousarray(matrix, dtype=np.float32)
+        if self.pq_m and x.shape[1] % self.pq_m:
+            raise ValueError(f"pq_m={self.pq_m} must divide dim={x.shape[1]}")
+        sample = x[rng.choice(len(x), min(len(x), MAX_TRAIN), replace=False)]
+
+        self.centroids = _kmeans(sample, self.n_lists, n_iter, rng, spherical=True)
+        self.n_lists = len(self.centroids)
+        assign = _assign(x, self.centroids, spherical=True)
+        self.list_rows = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=self.n_lists)
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        if self.pq_m:
+            residuals = x[self.list_rows] - self.centroids[assign[self.list_rows]]
+            train = sample - self.centroids[_assign(sample, self.centroids, True)]
+            sub = x.shape[1] // self.pq_m
+            self.codebooks = np.stack(
+                [
+                    _kmeans(
+                        train[:, m * sub : (m + 1) * sub],
+                        PQ_CENTROIDS,
+                        n_iter,
+                        rng,
+                        spherical=False,
+                    )
+                    for m in range(self.pq_m)
+                ]
+            )
+            self.codes = np.stack(
+                [
+                    _assign(residuals[:, m * sub : (m + 1) * sub], cb, spherical=False)
+                    for m, cb in enumerate(self.codebooks)
+                ],
+                axis=1,
+            ).astype(np.uint8)
+
+        self.ids_digest = ids_digest
+        return self
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        nprobe: int = 8,
+        matrix: np.ndarray | None = None,
+        rerank: int = 0,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return ``(rows, cosine scores)`` of the approximate top-``k``.
+
+        ``query`` must be L2-normalized. Without PQ the probed rows are scored
+        exactly against ``matrix``; with PQ the table-based scores of the best
+        ``rerank`` candidates are replaced by exact ones when ``matrix`` is set.
+        """
+        assert self.centroids is not None, "index has not been built"
+        coarse = self.centroids @ query
+        nprobe = min(nprobe, self.n_lists)
+        lists = np.argpartition(coarse, -nprobe)[-nprobe:]
+        spans = [(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists]
+        positions = np.concatenate([np.arange(a, b) for a, b in spans])
+        rows = self.list_rows[positions]
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+
+        if self.pq_m:
+            assert self.codebooks is not None and self.codes is not None
+            sub = len(query) // self.pq_m
+            tables = np.einsum(
+                "mjd,md->mj", self.codebooks, query.reshape(self.pq_m, sub)
+            )
+            base = np.repeat(coarse[lists], [b - a for a, b in spans])
+            codes = self.codes[positions]
+            scores = base + tables[np.arange(self.pq_m), codes].sum(axis=1)
+            if matrix is not None and rerank > 0:
+                keep = top_k(scores, max(k, rerank))
+                rows = rows[keep]
+                scores = matrix[rows] @ query
+        else:
+            if matrix is None:
+                raise ValueError("IVF-Flat search needs the gallery matrix")
+            scores = matrix[rows] @ query
+
+        top = top_k(scores, k)
+        return rows[top], scores[top]
+
+    def save(self, path: Path = INDEX_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            "n_lists": np.array(self.n_lists),
+            "pq_m": np.array(self.pq_m),
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "list_rows": self.list_rows,
+            "ids_digest": np.array(self.ids_digest),
+        }
+        if self.pq_m:
+            arrays["codebooks"] = self.codebooks
+            arrays["codes"] = self.codes
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: Path = INDEX_PATH) -> IVFIndex:
+        with np.load(path) as data:
+            index = cls(int(data["n_lists"]), int(data["pq_m"]))
+            index.centroids = data["centroids"]
+            index.list_offsets = data["list_offsets"]
+            index.list_rows = data["list_rows"]
+            index.ids_digest = str(data["ids_digest"])
+            if index.pq_m:
+                index.codebooks = data["codebooks"]
+                index.codes = data["codes"]
+        return index
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` largest scores, best first."""
+    k = min(k, len(scores))
+    top = np.argpartition(scores, -k)[-k:] if k < len(scores) else np.arange(k)
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def recall_report(
+    matrix: np.ndarray,
+    index: IVFIndex,
+    k: int = 10,
+    nprobes=(1, 2, 4, 8, 16, 32, 64),
+    rerank: int = 0,
+    n_queries: int = 200,
+    noise: float = 0.05,
+    seed: int = 0,
+):
+    """Print recall@1 / recall@k and latency of ``index`` against brute force.
+
+    Queries are gallery rows with Gaussian noise added, which stands in for a
+    live capture of a registered face.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(matrix), min(n_queries, len(matrix)), replace=False)
+    queries = matrix[picks] + rng.normal(0, noise, (len(picks), matrix.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+
+    t0 = time.perf_counter()
+    truth = [top_k(matrix @ q, k) for q in queries]
+    flat_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    print(
+        f"Gallery: {len(matrix)} x {matrix.shape[1]}, lists: {index.n_lists}, "
+        f"pq_m: {index.pq_m}, rerank: {rerank}, queries: {len(queries)}"
+    )
+    print(f"Brute force: {flat_ms:.3f} ms/query")
+    print(f"{'nprobe':>7} {'recall@1':>9} {f'recall@{k}':>10} {'ms/query':>9}")
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        hits1 = hitsk = 0
+        t0 = time.perf_counter()
+        results = [index.search(q, k, nprobe, matrix, rerank)[0] for q in queries]
+        ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        for rows, true in zip(results, truth):
+            hits1 += len(rows) > 0 and rows[0] == true[0]
+            hitsk += len(np.intersect1d(rows, true))
+        print(
+            f"{nprobe:>7} {hits1 / len(queries):>9.3f} "
+            f"{hitsk / (len(queries) * len(truth[0])):>10.3f} {ms:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from store import STORE_PATH, EmbeddingStore
+
+    parser = argparse.ArgumentParser(description="ANN recall vs brute force")
+    parser.add_argument("--store", type=Path, default=STORE_PATH)
+    parser.add_argument("--index", type=Path, default=INDEX_PATH)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    recall_report(
+        np.asarray(EmbeddingStore(args.store).matrix, dtype=np.float32),
+        IVFIndex.load(args.index),
+        k=args.k,
+        rerank=args.rerank,
+        n_queries=args.queries,
+    )
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import sys
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+RATE = 16_000
+FIXTURE_AUDIO_PATH = Path.cwd() / "data" / "asr_fixture.wav"
+FIXTURE_TEXT_PATH = Path.cwd() / "data" / "asr_fixture.txt"
+
+
+class AsrBackend:
+    """Speech-to-text model producing word-level timestamps."""
+
+    name = "asr"
+
+    def transcribe_words(
+        self, audio: np.ndarray, prompt: str | None = None
+    ) -> list[tuple[str, float]]:
+        """Return ``(word, end time in seconds)`` for 16 kHz float32 ``audio``."""
+        raise NotImplementedError
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        return " ".join(w for w, _ in self.transcribe_words(audio))
+
+
+def _plain_linears(module):
+    """Swap whisper's Linear subclass for nn.Linear so quantization sees it."""
+    import torch.nn as nn
+    import whisper.model
+
+    for name, child in module.named_children():
+        if isinstance(child, whisper.model.Linear):
+            plain = nn.Linear(
+                child.in_features, child.out_features, bias=child.bias is not None
+            )
+            plain.weight = child.weight
+            plain.bias = child.bias
+            setattr(module, name, plain)
+        else:
+            _plain_linears(child)
+
+
+class WhisperBackend(AsrBackend):
+    """openai-whisper on CPU, optionally with int8 dynamic-quantized linears."""
+
+    def __init__(self, size: str = "small", quantize: bool = False):
+        import torch
+        import whisper
+
+        self.name = f"whisper{'-int8' if quantize else ''}:{size}"
+        self.model = whisper.load_model(size, device="cpu")
+        if quantize:
+            _plain_linears(self.model)
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+    def transcribe_words(self, audio, prompt=None):
+        result = self.model.transcribe(
+            audio,
+            fp16=False,
+            initial_prompt=prompt or None,
+            condition_on_previous_text=False,
+            word_timestamps=True,
+        )
+        return [
+            (w["word"].strip(), float(w["end"]))
+            for segment in result["segments"]
+            for w in segment.get("words", [])
+            if w["word"].strip()
+        ]
+
+
+class FasterWhisperBackend(AsrBackend):
+    """CTranslate2 Whisper (``faster-whisper``) with int8 weights, if installed."""
+
+    def __init__(self, size: str = "small", compute_type: str = "int8"):
+        from faster_whisper import WhisperModel
+
+        self.name = f"faster-whisper:{size}"
+        self.model = WhisperModel(size, device="cpu", compute_type=compute_type)
+
+    def transcribe_words(self, audio, prompt=None):
+        segments, _ = self.model.transcribe(
+            audio,
+            initial_prompt=prompt or None,
+            condition_on_previous_text=False,
+            word_timestamps=True,
+        )
+        return [
+            (w.word.strip(), float(w.end))
+            for segment in segments
+            for w in segment.words or []
+            if w.word.strip()
+        ]
+
+
+def get_asr_backend(name: str = "whisper", size: str = "small") -> AsrBackend:
+    """Create a backend: ``whisper``, ``whisper-int8`` or ``faster-whisper``."""
+    if name == "whisper":
+        return WhisperBackend(size)
+    if name == "whisper-int8":
+        return WhisperBackend(size, quantize=True)
+    if name == "faster-whisper":
+        return FasterWhisperBackend(size)
+    raise ValueError(f"Unknown ASR backend '{name}'")
+
+
+def load_wav(path: Path) -> np.ndarray:
+    """Read a 16-bit PCM WAV as mono float32 at 16 kHz."""
+    with wave.open(str(path), "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16-bit PCM")
+        rate, channels = f.getframerate(), f.getnchannels()
+        pcm = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+    audio = pcm.reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+    if rate != RATE:
+        n = int(len(audio) * RATE / rate)
+        audio = np.interp(
+            np.arange(n) * rate / RATE, np.arange(len(audio)), audio
+        ).astype(np.float32)
+    return audio
+
+
+def _words(text: str) -> list[str]:
+    cleaned = "".join(c if c.isalnum() or c.isspace() else " " for c in text.lower())
+    return cleaned.split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1] / max(1, len(ref))
+
+
+def benchmark(specs, audio: np.ndarray, reference: str, repeats: int = 1):
+    """Print load time, real-time factor and WER for each ``name:size`` spec.
+
+    A real-time factor below 1.0 means the backend keeps up with live audio.
+    """
+    duration = len(audio) / RATE
+    print(f"Fixture: {duration:.1f}s of audio, {len(_words(reference))} words")
+    print(f"{'backend':<24} {'load s':>7} {'RTF':>6} {'WER':>6}")
+    for spec in specs:
+        name, _, size = spec.partition(":")
+        try:
+            start = time.perf_counter()
+            backend = get_asr_backend(name, size or "small")
+            load = time.perf_counter() - start
+            backend.transcribe(audio[: RATE * 2])  # warm-up
+            start = time.perf_counter()
+            for _ in range(repeats):
+                text = backend.transcribe(audio)
+        except Exception as e:  # missing package, model download failure, ...
+            print(f"{spec:<24} unavailable ({type(e).__name__}: {e})")
+            continue
+        rtf = (time.perf_counter() - start) / repeats / duration
+        wer = word_error_rate(reference, text)
+        print(f"{backend.name:<24} {load:>7.1f} {rtf:>6.3f} {wer:>6.3f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark ASR backends")
+    parser.add_argument(
+        "backends",
+        nargs="*",
+        default=["whisper:tiny", "whisper-int8:tiny", "whisper:small"],
+        help="name:size specs, e.g. whisper-int8:base faster-whisper:small",
+    )
+    parser.add_argument("--audio", type=Path, default=FIXTURE_AUDIO_PATH)
+    parser.add_argument("--reference", type=Path, default=FIXTURE_TEXT_PATH)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    missing = [p for p in (args.audio, args.reference) if not p.is_file()]
+    if missing:
+        print(f"Missing fixture: {', '.join(str(p) for p in missing)}")
+        print(
+            "Record a 16-bit PCM WAV of a few sentences and save its transcript "
+            "as UTF-8 text, then pass them with --audio and --reference (or "
+            f"save them as {FIXTURE_AUDIO_PATH} and {FIXTURE_TEXT_PATH})."
+        )
+        sys.exit(1)
+    benchmark(
+        args.backends,
+        load_wav(args.audio),
+        args.reference.read_text(encoding="utf-8"),
+        args.repeats,
+    )
@@ -3,11 +3,12 @@ import subprocess
 import sys
 
 import numpy as np
-import whisper
 
-from audio_analysis import analyze_text_for_threats
+from asr import AsrBackend, get_asr_backend
+from audio_analysis import analyze_text_for_threats, cascade_stats
 from notification import send_text_dm
 from settings import settings
+from vad import MIN_SPEECH_MS, EnergyVAD, VadStats
 
 SRC_RATE = 48_000  # pw-record rate
 TGT_RATE = 16_000  # Whisper expects 16 kHz
@@ -16,7 +17,13 @@ SAMPWIDTH = 2  # s16
 FRAMES = 4096  # pw-record chunk size (frames)
 CHUNK_BYTES = FRAMES * CH * SAMPWIDTH
 WINDOW_SEC = 30
-CHUNKS_PER_WIN = (SRC_RATE * WINDOW_SEC) // FRAMES  # 48000/4096 * 30 ≈ 351
+HOP_SEC = 5  # decode newly arrived audio every HOP_SEC
+DECIMATION = SRC_RATE // TGT_RATE  # 48 kHz -> 16 kHz (exact decimation by 3)
+STATS_EVERY = 60  # hops between VAD / decode cost reports
+PROMPT_WORDS = 50  # committed words passed to Whisper as context
+MAX_PENDING_SEC = 15  # force a commit if the hypothesis never stabilises
+MAX_COMMITTED_WORDS = 1000  # committed transcript kept in memory
+FEED_WORDS = 80  # transcript tail handed to the threat classifier
 
 CMD = [
     "pw-record",
@@ -32,8 +39,158 @@ CMD = [
 ]
 
 
+class AudioRingBuffer:
+    """Preallocated ring of mono float32 16 kHz samples.
+
+    Raw s16 stereo 48 kHz chunks are decimated, downmixed and scaled straight
+    into the ring as they arrive, so no per-window arrays are allocated.
+    """
+
+    def __init__(self, window_sec: int = WINDOW_SEC):
+        self.capacity = TGT_RATE * window_sec
+        self._buf = np.zeros(self.capacity, dtype=np.float32)
+        self._out = np.empty(self.capacity, dtype=np.float32)
+        self._pos = 0  # next write index in _buf
+        self._phase = 0  # index of the next kept source frame in the next chunk
+        self._partial = b""  # trailing bytes of an incomplete frame
+        self.total = 0  # samples written since start
+
+    def push(self, chunk: bytes):
+        frame_bytes = CH * SAMPWIDTH
+        if self._partial:
+            chunk = self._partial + chunk
+        usable = len(chunk) - len(chunk) % frame_bytes
+        self._partial = chunk[usable:]
+        frames = np.frombuffer(chunk, dtype=np.int16, count=usable // SAMPWIDTH)
+        frames = frames.reshape(-1, CH)
+
+        kept = frames[self._phase :: DECIMATION]
+        self._phase = (self._phase - len(frames)) % DECIMATION
+        kept = kept[-self.capacity :]
+
+        first = min(len(kept), self.capacity - self._pos)
+        self._downmix(kept[:first], self._buf[self._pos : self._pos + first])
+        self._downmix(kept[first:], self._buf[: len(kept) - first])
+        self._pos = (self._pos + len(kept)) % self.capacity
+        self.total += len(kept)
+
+    @staticmethod
+    def _downmix(src: np.ndarray, dst: np.ndarray):
+        # int16 stereo -> float32 mono in [-1, 1], written into dst
+        src.sum(axis=1, dtype=np.float32, out=dst)
+        dst *= 1.0 / (CH * 32768.0)
+
+    def window(self) -> np.ndarray:
+        """The latest (up to) ``capacity`` samples in time order.
+
+        Returns a view into a reused buffer, valid until the next call.
+        """
+        if self.total < self.capacity:
+            return self._buf[: self.total]
+        tail = self.capacity - self._pos
+        self._out[:tail] = self._buf[self._pos :]
+        self._out[tail:] = self._buf[: self._pos]
+        return self._out
+
+    def since(self, start: int) -> np.ndarray:
+        """Samples from absolute index ``start`` to now, clamped to the ring."""
+        start = max(start, self.total - self.capacity, 0)
+        window = self.window()
+        return window[len(window) - (self.total - start) :]
+
+
+def _norm(word: str) -> str:
+    return "".join(c for c in word.lower() if c.isalnum())
+
+
+class StreamingTranscriber:
+    """Incremental Whisper transcription over an AudioRingBuffer.
+
+    Each step decodes only the audio after the last committed word, with the
+    committed text as the prompt. Words that two consecutive hypotheses agree
+    on are committed and their audio is dropped, so the decoded text stays
+    short instead of covering a full window. Every sample is still decoded
+    at least twice before it commits, and Whisper pads each call to a 30 s
+    input, so encoder cost per step is constant; the savings come from
+    shorter decodes and from skipping hops the VAD finds silent.
+    """
+
+    def __init__(self, asr: AsrBackend, vad: EnergyVAD):
+        self.asr = asr
+        self.vad = vad
+        self.vad_stats = VadStats()
+        self.committed: list[str] = []
+        self.n_committed = 0  # total words ever committed
+        self.start = 0  # absolute sample index of the uncommitted audio
+        self._hypothesis: list[tuple[str, int]] = []  # (word, end sample)
+        self._seen = 0
+        self.new_samples = 0
+        self.decoded_samples = 0
+
+    def step(self, ring: AudioRingBuffer) -> list[str]:
+        """Decode audio that arrived since the last commit; return new words."""
+        new = ring.total - self._seen
+        self._seen = ring.total
+        self.new_samples += new
+        if self.start < ring.total - ring.capacity:
+            # Fell behind the ring, the pending audio is gone
+            self.start = ring.total - ring.capacity
+            self._hypothesis = []
+
+        audio = ring.since(self.start)
+        segments = self.vad.segments(audio)
+        if self.vad.voiced_ms < MIN_SPEECH_MS:
+            self.vad_stats.record(new, 0)
+            if not segments or segments[-1][1] < len(audio):
+                # Silence, or a short burst (a click) that is over: drop it
+                self.start = ring.total
+                self._hypothesis = []
+            return []  # otherwise speech may still be starting, wait for more
+        self.vad_stats.record(new, new)
+        if not self._hypothesis:
+            # Nothing pending, so leading silence can be dropped for good
+            self.start += segments[0][0]
+            audio = audio[segments[0][0] :]
+
+        prompt = " ".join(self.committed[-PROMPT_WORDS:])
+        words = [
+            (word, self.start + int(end * TGT_RATE))
+            for word, end in self.asr.transcribe_words(audio, prompt)
+        ]
+        self.decoded_samples += len(audio)
+
+        agree = 0
+        limit = min(len(words), len(self._hypothesis))
+        while agree < limit and _norm(words[agree][0]) == _norm(
+            self._hypothesis[agree][0]
+        ):
+            agree += 1
+        if agree == 0 and len(audio) > MAX_PENDING_SEC * TGT_RATE:
+            agree = max(0, len(words) - 2)
+        self._hypothesis = words[agree:]
+        if agree == 0:
+            return []
+
+        committed = [w for w, _ in words[:agree]]
+        self.start = words[agree - 1][1]
+        self.committed.extend(committed)
+        del self.committed[:-MAX_COMMITTED_WORDS]
+        self.n_committed += len(committed)
+        return committed
+
+    def tail(self, n: int, since: int = 0) -> str:
+        """The last ``n`` committed words, excluding those before word ``since``."""
+        n = min(n, self.n_committed - since, len(self.committed))
+        return " ".join(self.committed[-n:]) if n > 0 else ""
+
+    def summary(self) -> str:
+        ratio = self.decoded_samples / self.new_samples if self.new_samples else 0.0
+        return f"{self.vad_stats.summary()}; ASR input {ratio:.2f}x of new audio"
+
+
 def spawn_audio_detection_thread():
-    model = whisper.load_model("small")
+    asr = get_asr_backend(settings.ASR_BACKEND, settings.ASR_MODEL_SIZE)
+    print(f"Using ASR backend {asr.name}")
 
     proc = subprocess.Popen(
         CMD,
@@ -45,48 +202,42 @@ def spawn_audio_detection_thread():
         sys.exit("pw-record stdout unavailable")
     atexit.register(proc.kill)
 
-    buf = []
+    ring = AudioRingBuffer()
+    transcriber = StreamingTranscriber(asr, EnergyVAD(TGT_RATE))
+    hop = TGT_RATE * HOP_SEC
+    next_step_at = hop
+    steps = 0
+    # Words before this index were part of an alert and are not re-analyzed
+    feed_from = 0
     try:
         while True:
             chunk = proc.stdout.read(CHUNK_BYTES)
             if not chunk:
                 break
-            buf.append(chunk)
-            if len(buf) >= CHUNKS_PER_WIN:
-                block = b"".join(buf)
-                buf.clear()
-
-                # bytes -> int16 -> stereo to mono
-                pcm = (
-                    np.frombuffer(block, dtype=np.int16)
-                    .reshape(-1, CH)
-                    .mean(axis=1)
-                    .astype(np.int16)
-                )
-
-                # int16 -> float32 in [-1, 1]
-                mono = pcm.astype(np.float32) / 32768.0
-
-                # 48 kHz -> 16 kHz (exact decimation by 3)
-                audio = mono[:: (SRC_RATE // TGT_RATE)].copy()
-
-                text = model.transcribe(audio, fp16=False)["text"]
-                assert isinstance(text, str)
-                if text.strip():
-                    print(f"Transcribed: {text}")
-                    if analyze_text_for_threats(text):
-                        alert_message = f"""🚨 AUDIO THREAT ALERT 🚨
+            ring.push(chunk)
+            if ring.total < next_step_at:
+                continue
+            next_step_at = ring.total + hop
+
+            words = transcriber.step(ring)
+            steps += 1
+            if steps % STATS_EVERY == 0:
+                print(transcriber.summary())
+                print(cascade_stats.summary())
+            if not words:
+                continue
+
+            print(f"Transcribed: {' '.join(words)}")
+            text = transcriber.tail(FEED_WORDS, since=feed_from)
+            if analyze_text_for_threats(text):
+                feed_from = transcriber.n_committed
+                alert_message = f"""🚨 AUDIO THREAT ALERT 🚨
 
 Transcribed text: {text}
 
 AI detected potential threat in the conversation. Please review immediately."""
-                        success = send_text_dm(
-                            settings.INSTAGRAM_DM_RECIPIENT, alert_message
-                        )
-                        if success:
-                            print("Threat alert sent successfully!")
-                        else:
-                            print("Failed to send threat alert.")
+                send_text_dm(settings.INSTAGRAM_DM_RECIPIENT, alert_message)
+                print("Threat alert queued.")
 
     finally:
         proc.kill()
@@ -1,29 +1,160 @@
-import openai
+import csv
+import re
+import threading
+import time
+import zlib
+from pathlib import Path
 
-from settings import settings
+import numpy as np
 
+from settings import settings
 
-def analyze_text_for_threats(text: str) -> bool:
-    print("Analyzing text for threats...")
-    if not settings.TOGETHER_API_KEY:
-        print("Warning: TOGETHER_API_KEY not set, skipping AI analysis")
-        return False
+LOCAL_MODEL_PATH = Path.cwd() / "models" / "threat_classifier.npz"
+LLM_MODEL = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
+LLM_TIMEOUT_SEC = 10.0
+LOCAL_BENIGN_BELOW = 0.1  # local model scores below this are cleared
+LOCAL_THREAT_ABOVE = 0.95  # and above this are flagged without the LLM
+N_FEATURES = 2**18  # hashed unigram + bigram buckets of the local model
 
-    try:
-        client = openai.OpenAI(
-            api_key=settings.TOGETHER_API_KEY,
-            base_url="https://api.together.xyz/v1",
-        )
+# Text without any of these is cleared without further analysis.
+RISK_PATTERNS = re.compile(
+    r"\b("
+    r"secret|don'?t tell|do not tell|nobody (needs to|has to) know|"
+    r"alone|home by yourself|parents? (away|gone|home)|"
+    r"get in|come with me|pick (you|u) up|meet (me|up)|my (car|van|place|house)|"
+    r"how old|where do you live|what school|address|"
+    r"send (me )?(a )?(pic|pics|photo|photos|picture|pictures)|"
+    r"take (off|your clothes)|touch|kiss|"
+    r"kill|hurt|gun|knife|weapon|shoot|stab|hit you|"
+    r"help( me)?|stop|scared|afraid|police|call 911|"
+    r"follow(ing)? (you|me)|kidnap|grab|trafficking|drugs?"
+    r")\b",
+    re.IGNORECASE,
+)
 
-        prompt = f"""Analyze the following text from a conversation. Does it indicate any suspicious threats, dangerous situations, or content that would warrant contacting authorities or third parties for safety concerns? Consider threats to personal safety, criminal activity, or emergency situations.
+PROMPT = """Analyze the following text from a conversation. Does it indicate any suspicious threats, dangerous situations, or content that would warrant contacting authorities or third parties for safety concerns? Consider threats to personal safety, criminal activity, or emergency situations.
 
 Text: "{text}"
 
 Answer only 'YES' or 'NO'."""
 
-        response = client.chat.completions.create(
-            model="meta-llama/Llama-3.2-3B-Instruct-Turbo",
-            messages=[{"role": "user", "content": prompt}],
+
+class CascadeStats:
+    """Decisions and time spent per cascade tier."""
+
+    TIERS = ("keyword", "local", "llm")
+
+    def __init__(self):
+        self.decisions = dict.fromkeys(self.TIERS, 0)
+        self.seconds = dict.fromkeys(self.TIERS, 0.0)
+        self._lock = threading.Lock()
+
+    def record(self, tier: str, elapsed: float):
+        with self._lock:
+            self.decisions[tier] += 1
+            self.seconds[tier] += elapsed
+
+    def summary(self) -> str:
+        total = sum(self.decisions.values())
+        parts = []
+        for tier in self.TIERS:
+            n = self.decisions[tier]
+            rate = 100 * n / total if total else 0.0
+            mean = 1000 * self.seconds[tier] / n if n else 0.0
+            parts.append(f"{tier} {rate:.1f}% ({mean:.3f} ms)")
+        return f"Threat cascade over {total} texts: " + ", ".join(parts)
+
+
+cascade_stats = CascadeStats()
+
+
+def _tokens(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def _features(text: str) -> np.ndarray:
+    tokens = _tokens(text)
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return np.unique([zlib.crc32(g.encode("utf-8")) % N_FEATURES for g in grams])
+
+
+class LocalThreatModel:
+    """Hashed n-gram logistic regression; scores a transcript in microseconds."""
+
+    def __init__(self, weights: np.ndarray | None = None, bias: float = 0.0):
+        self.weights = (
+            weights if weights is not None else np.zeros(N_FEATURES, np.float32)
+        )
+        self.bias = bias
+
+    def predict_proba(self, text: str) -> float:
+        z = self.weights[_features(text)].sum() + self.bias
+        return float(1.0 / (1.0 + np.exp(-z)))
+
+    def train(self, texts, labels, epochs: int = 10, lr: float = 0.5, l2=1e-5):
+        rng = np.random.default_rng(0)
+        feats = [_features(t) for t in texts]
+        labels = np.asarray(labels, dtype=np.float32)
+        for _ in range(epochs):
+            for i in rng.permutation(len(feats)):
+                p = 1.0 / (1.0 + np.exp(-(self.weights[feats[i]].sum() + self.bias)))
+                grad = p - labels[i]
+                self.weights[feats[i]] -= lr * (grad + l2 * self.weights[feats[i]])
+                self.bias -= lr * grad
+        return self
+
+    def save(self, path: Path = LOCAL_MODEL_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, weights=self.weights, bias=np.array(self.bias))
+
+    @classmethod
+    def load(cls, path: Path = LOCAL_MODEL_PATH) -> "LocalThreatModel":
+        with np.load(path) as data:
+            return cls(data["weights"], float(data["bias"]))
+
+
+_local_model: LocalThreatModel | None = None
+_local_model_loaded = False
+_client = None
+_init_lock = threading.Lock()
+
+
+def _get_local_model() -> LocalThreatModel | None:
+    global _local_model, _local_model_loaded
+    with _init_lock:
+        if not _local_model_loaded:
+            if LOCAL_MODEL_PATH.is_file():
+                _local_model = LocalThreatModel.load(LOCAL_MODEL_PATH)
+            _local_model_loaded = True
+    return _local_model
+
+
+def _get_client():
+    """One pooled client for every LLM call instead of one per transcript."""
+    global _client
+    with _init_lock:
+        if _client is None:
+            import openai
+
+            _client = openai.OpenAI(
+                api_key=settings.TOGETHER_API_KEY,
+                base_url=settings.TOGETHER_BASE_URL,
+                timeout=LLM_TIMEOUT_SEC,
+                max_retries=1,
+            )
+    return _client
+
+
+def _ask_llm(text: str) -> bool:
+    if not settings.TOGETHER_API_KEY:
+        print("Warning: TOGETHER_API_KEY not set, skipping AI analysis")
+        return False
+
+    try:
+        response = _get_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": PROMPT.format(text=text)}],
             max_tokens=10,
             temperature=0.1,
         )
@@ -36,3 +167,53 @@ Answer only 'YES' or 'NO'."""
     except Exception as e:
         print(f"Error analyzing text with AI: {e}")
         return False
+
+
+def analyze_text_for_threats(text: str) -> bool:
+    """Keyword screen, then the local model, then the LLM for what's left."""
+    start = time.perf_counter()
+    if not RISK_PATTERNS.search(text):
+        cascade_stats.record("keyword", time.perf_counter() - start)
+        return False
+
+    model = _get_local_model()
+    if model is not None:
+        p = model.predict_proba(text)
+        if p < LOCAL_BENIGN_BELOW or p > LOCAL_THREAT_ABOVE:
+            cascade_stats.record("local", time.perf_counter() - start)
+            return p > LOCAL_THREAT_ABOVE
+
+    print("Analyzing text for threats...")
+    verdict = _ask_llm(text)
+    cascade_stats.record("llm", time.perf_counter() - start)
+    return verdict
+
+
+def _read_labeled(path: Path) -> tuple[list[str], list[int]]:
+    """Rows of ``text,label`` with label 1 for a threat and 0 otherwise."""
+    texts, labels = [], []
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            texts.append(row["text"])
+            labels.append(int(row["label"]))
+    return texts, labels
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Threat classifier cascade")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("csv", type=Path, help="labeled text,label rows")
+    args = parser.parse_args()
+
+    texts, labels = _read_labeled(args.csv)
+    if args.command == "train":
+        LocalThreatModel().train(texts, labels).save(LOCAL_MODEL_PATH)
+        print(f"Saved local threat model to {LOCAL_MODEL_PATH}")
+    else:
+        correct = sum(
+            analyze_text_for_threats(t) == bool(y) for t, y in zip(texts, labels)
+        )
+        print(f"Accuracy: {correct / len(texts):.3f} over {len(texts)} texts")
+        print(cascade_stats.summary())
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import os
+import platform
+import subprocess as sp
+import tempfile
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+IS_MACOS = platform.system() == "Darwin"
+REPLAY_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def parse_geometry(geom: str) -> tuple[int, int, int, int]:
+    """Split an ``"x,y wxh"`` geometry string into ``(x, y, w, h)``."""
+    pos_part, size_part = geom.split(" ")
+    x, y = map(int, pos_part.split(","))
+    w, h = map(int, size_part.split("x"))
+    return x, y, w, h
+
+
+class CaptureBackend:
+    """Grabs a screen region as a BGR or BGRA NumPy image."""
+
+    needs_window = True  # whether grab() needs the target window geometry
+
+    def grab(self, geom: str | None) -> np.ndarray | None:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MssCapture(CaptureBackend):
+    """In-process capture with mss; no subprocess and no image encoding.
+
+    The returned array is a BGRA view over the pixel buffer mss allocates
+    for each grab, so frames can be handed to other threads safely.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._handles = []  # every handle created, so close() reaches them all
+        self._lock = threading.Lock()
+
+    def _sct(self):
+        # mss handles are bound to the thread that created them
+        if not hasattr(self._local, "sct"):
+            import mss
+
+            sct = mss.mss()
+            with self._lock:
+                self._handles.append(sct)
+            self._local.sct = sct
+        return self._local.sct
+
+    def grab(self, geom: str | None) -> np.ndarray | None:
+        assert geom is not None
+        x, y, w, h = parse_geometry(geom)
+        try:
+            shot = self._sct().grab({"left": x, "top": y, "width": w, "height": h})
+        except Exception as e:
+            print(f"Error capturing screenshot with mss: {e}")
+            return None
+        # shot.raw is a bytearray, so frombuffer wraps it without copying
+        return np.frombuffer(shot.raw, np.uint8).reshape(shot.height, shot.width, 4)
+
+    def close(self):
+        with self._lock:
+            handles, self._handles = self._handles, []
+            self._local = threading.local()
+        for sct in handles:
+            try:
+                sct.close()
+            except Exception as e:
+                print(f"Error closing mss handle: {e}")
+
+
+class SubprocessCapture(CaptureBackend):
+    """Capture through ``grim`` (Wayland) or ``screencapture`` (macOS)."""
+
+    def grab(self, geom: str | None) -> np.ndarray | None:
+        assert geom is not None
+        if IS_MACOS:
+            return self._grab_macos(geom)
+        return self._grab_linux(geom)
+
+    def _grab_linux(self, geom: str) -> np.ndarray | None:
+        try:
+            output = sp.check_output(["grim", "-g", geom, "-"])
+            img_np = np.frombuffer(output, np.uint8)
+            return cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+        except sp.CalledProcessError as e:
+            print(f"Error capturing screenshot on Linux: {e}")
+            return None
+
+    def _grab_macos(self, geom: str) -> np.ndarray | None:
+        x, y, w, h = parse_geometry(geom)
+
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
+            temp_path = temp_file.name
+
+        try:
+            cmd = ["screencapture", "-R", f"{x},{y},{w},{h}", "-o", temp_path]
+
+            result = sp.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(
+                    f"ERROR: screencapture failed with return code {result.returncode}"
+                )
+                print(f"stderr: {result.stderr}")
+                return None
+
+            if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
+                print("ERROR: Screenshot file is empty or was not created")
+                return None
+
+            decoded_img = cv2.imread(temp_path)
+            if decoded_img is None:
+                print("ERROR: Failed to load screenshot image")
+                return None
+
+            return decoded_img
+
+        except Exception as e:
+            print(f"Error capturing screenshot on macOS: {e}")
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+
+class ReplayCapture(CaptureBackend):
+    """Replays a video file or a directory of images instead of the screen."""
+
+    needs_window = False
+
+    def __init__(self, path: str | Path, loop: bool = True):
+        self.path = Path(path)
+        self.loop = loop
+        self._video: cv2.VideoCapture | None = None
+        self._frames: list[Path] = []
+        self._pos = 0
+        if self.path.is_dir():
+            self._frames = sorted(
+                p for p in self.path.iterdir() if p.suffix.lower() in REPLAY_EXTENSIONS
+            )
+            if not self._frames:
+                raise FileNotFoundError(f"No images to replay in {self.path}")
+        else:
+            self._video = cv2.VideoCapture(str(self.path))
+            if not self._video.isOpened():
+                raise FileNotFoundError(f"Cannot open video {self.path}")
+
+    def grab(self, geom: str | None = None) -> np.ndarray | None:
+        if self._video is not None:
+            ok, frame = self._video.read()
+            if not ok and self.loop:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self._video.read()
+            return frame if ok else None
+
+        if self._pos >= len(self._frames):
+            if not self.loop:
+                return None
+            self._pos = 0
+        frame = cv2.imread(str(self._frames[self._pos]))
+        self._pos += 1
+        return frame
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+
+
+def get_capture_backend(name: str = "auto", replay_path: str | None = None):
+    """Create a backend by name: ``auto``, ``mss``, ``subprocess`` or ``replay``.
+
+    ``auto`` picks mss except under Wayland, where X11-based grabbing cannot
+    see other clients and grim is still needed.
+    """
+    if name == "auto":
+        wayland = not IS_MACOS and os.environ.get("WAYLAND_DISPLAY")
+        name = "subprocess" if wayland else "mss"
+    if name == "mss":
+        return MssCapture()
+    if name == "subprocess":
+        return SubprocessCapture()
+    if name == "replay":
+        if not replay_path:
+            raise ValueError("The replay capture backend needs CAPTURE_REPLAY_PATH")
+        return ReplayCapture(replay_path)
+    raise ValueError(f"Unknown capture backend '{name}'")
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print('Usage: python capture.py "<x,y wxh>" [backend] [frames]')
+        sys.exit(1)
+
+    backend = get_capture_backend(sys.argv[2] if len(sys.argv) > 2 else "auto")
+    n = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    start = time.perf_counter()
+    for _ in range(n):
+        frame = backend.grab(sys.argv[1])
+    elapsed = time.perf_counter() - start
+    shape = None if frame is None else frame.shape
+    print(f"{type(backend).__name__}: {1000 * elapsed / n:.2f} ms/frame, {shape}")
+    backend.close()
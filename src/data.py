@@ -1,78 +1,245 @@
-import csv
+import json
+import os
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from registry import read_registry
 
 # Disable SSL warnings when we use verify=False
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 OFFENDER_CSV_PATH = Path("data/offender_list - offender_list.csv")
 OFFENDER_IMAGES_DIR = Path("data/offender_list/images")
+IMAGES_MANIFEST_PATH = OFFENDER_IMAGES_DIR.parent / "images.json"
+DOWNLOAD_WORKERS = 8
+REQUEST_TIMEOUT = 10
 
 
 def make_safe_name(name: str) -> str:
-    """Convert a name to a filesystem-safe string."""
+    """Convert a name to a filesystem-safe string (the old photo file names)."""
     safe = "".join(c for c in name if c.isalnum() or c in (" ", "-", "_")).rstrip()
     return safe.replace(" ", "_")
 
 
-def unmake_safe_name(safe_name: str) -> str:
-    """Convert a filesystem-safe string back to a regular name."""
-    # remove extension if present
-    if "." in safe_name:
-        safe_name = safe_name.rsplit(".", 1)[0]
-    return safe_name.replace("_", " ")
-
-def get_image_path(name: str) -> Path:
-    """Get the local image path for a given offender name."""
-    safe_name = make_safe_name(name)
-    return OFFENDER_IMAGES_DIR / f"{safe_name}.jpg"
-
-def download_images_if_missing():
-    OFFENDER_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-
-    if OFFENDER_CSV_PATH.exists():
-        with open(OFFENDER_CSV_PATH, "r", newline="", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip header row
-            for row in reader:
-                if len(row) > 1:  # Make sure there's a second column
-                    name = row[0].strip()  # Name is in the first column (index 0)
-                    link = row[1].strip()  # Image URL is in the second column (index 1)
-                    if (
-                        link and link.startswith("http") and name
-                    ):  # Only add valid URLs with names
-                        # Clean the name to be filesystem-safe
-                        safe_name = make_safe_name(name)
-
-                        # Use the person's name as the filename with .jpg extension
-                        filename = OFFENDER_IMAGES_DIR / f"{safe_name}.jpg"
-                        if not filename.exists():
-                            try:
-                                # Try with SSL verification first
-                                try:
-                                    resp = requests.get(link, timeout=10, verify=True)
-                                except requests.exceptions.SSLError:
-                                    # If SSL verification fails, try without verification
-                                    print(
-                                        f"SSL verification failed for {link}, trying without verification..."
-                                    )
-                                    resp = requests.get(link, timeout=10, verify=False)
-
-                                if resp.status_code == 200:
-                                    with open(filename, "wb") as f:
-                                        f.write(resp.content)
-                                    print(f"Downloaded {filename}")
-                                else:
-                                    print(
-                                        f"Failed to download {link}: status {resp.status_code}"
-                                    )
-                            except Exception as e:
-                                print(f"Error downloading {link}: {e}")
-                        else:
-                            print(f"Already exists: {filename}")
+def get_image_path(offender_id: str) -> Path:
+    """Get the local image path for a given offender ID."""
+    return OFFENDER_IMAGES_DIR / f"{offender_id}.jpg"
+
+
+def read_image_links(csv_path: Path = OFFENDER_CSV_PATH) -> list[tuple[str, str]]:
+    """Return ``(offender id, image url)`` pairs from the registry CSV."""
+    _, rows = read_registry(csv_path)
+    return [
+        (oid, row[1].strip())
+        for oid, row in rows
+        if len(row) > 1 and row[1].strip().startswith("http")
+    ]
+
+
+def migrate_name_keyed_images(
+    csv_path: Path = OFFENDER_CSV_PATH,
+    images_dir: Path = OFFENDER_IMAGES_DIR,
+    manifest_path: Path = IMAGES_MANIFEST_PATH,
+) -> int:
+    """Rename photos saved as ``make_safe_name(name).jpg`` to ``<id>.jpg``.
+
+    Names that map to the same safe name are ambiguous and left to be
+    downloaded again under their IDs.
+    """
+    _, rows = read_registry(csv_path)
+    owners = Counter(make_safe_name(row[0].strip()) for _, row in rows)
+    manifest = {}
+    if manifest_path.is_file():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    moved = 0
+    for oid, row in rows:
+        safe = make_safe_name(row[0].strip())
+        old, new = images_dir / f"{safe}.jpg", images_dir / f"{oid}.jpg"
+        if owners[safe] != 1 or old == new or new.exists() or not old.exists():
+            continue
+        os.replace(old, new)
+        if old.name in manifest:
+            manifest[new.name] = manifest.pop(old.name)
+        moved += 1
+    if moved:
+        tmp = manifest_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_path)
+        print(f"Renamed {moved} registry photos to their offender IDs")
+    return moved
+
+
+def make_session(pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """HTTP session with one pooled connection per worker and transient retries."""
+    session = requests.Session()
+    retries = Retry(
+        total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ImageDownloader:
+    """Fetch registry photos concurrently over a shared pooled session.
+
+    A manifest next to the images records the source URL, ETag and
+    Last-Modified of every fetched photo. Photos already in the manifest are
+    skipped without touching the filesystem; with ``revalidate`` they are
+    re-checked with a conditional GET instead. Files are written to a
+    temporary name and renamed into place, so an interrupted run never
+    leaves a truncated image behind.
+    """
+
+    def __init__(
+        self,
+        images_dir: Path = OFFENDER_IMAGES_DIR,
+        manifest_path: Path = IMAGES_MANIFEST_PATH,
+        workers: int = DOWNLOAD_WORKERS,
+        session: requests.Session | None = None,
+    ):
+        self.images_dir = images_dir
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.session = session or make_session(workers)
+        self.manifest: dict[str, dict] = {}
+        self._insecure_hosts: set[str] = set()
+        self._lock = threading.Lock()
+        if manifest_path.is_file():
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def _get(self, url: str, headers: dict) -> requests.Response:
+        host = urlsplit(url).netloc
+        if host not in self._insecure_hosts:
+            try:
+                return self.session.get(
+                    url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True
+                )
+            except requests.exceptions.SSLError:
+                # Remember the host so later photos skip the failing handshake
+                print(
+                    f"SSL verification failed for {host}, trying without verification..."
+                )
+                with self._lock:
+                    self._insecure_hosts.add(host)
+        return self.session.get(
+            url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True, verify=False
+        )
+
+    def fetch(self, offender_id: str, url: str, revalidate: bool = False) -> str:
+        """Download one photo; returns ``skipped``, ``not_modified``,
+        ``downloaded`` or ``failed``."""
+        filename = f"{offender_id}.jpg"
+        entry = self.manifest.get(filename)
+        if entry is not None and entry.get("url") == url and not revalidate:
+            return "skipped"
+        path = self.images_dir / filename
+        if entry is None and path.exists():
+            # Fetched before the manifest existed; adopt it without validators
+            with self._lock:
+                self.manifest[filename] = {"url": url}
+            return "skipped"
+
+        headers = {}
+        if entry is not None and entry.get("url") == url and path.exists():
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with self._get(url, headers) as resp:
+                if resp.status_code == 304:
+                    return "not_modified"
+                if resp.status_code != 200:
+                    print(f"Failed to download {url}: status {resp.status_code}")
+                    return "failed"
+                fd, tmp = tempfile.mkstemp(dir=self.images_dir, suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        for chunk in resp.iter_content(chunk_size=64 * 1024):
+                            f.write(chunk)
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+                with self._lock:
+                    self.manifest[filename] = {
+                        "url": url,
+                        "etag": resp.headers.get("ETag"),
+                        "last_modified": resp.headers.get("Last-Modified"),
+                    }
+        except Exception as e:
+            print(f"Error downloading {url}: {e}")
+            return "failed"
+        print(f"Downloaded {path}")
+        return "downloaded"
+
+    def save_manifest(self):
+        tmp = self.manifest_path.with_suffix(".tmp")
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def run(self, links, revalidate: bool = False) -> Counter:
+        """Fetch all ``(offender id, url)`` links; returns a count per outcome."""
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        outcomes: Counter = Counter()
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                for outcome in pool.map(
+                    lambda link: self.fetch(*link, revalidate=revalidate), links
+                ):
+                    outcomes[outcome] += 1
+        finally:
+            self.save_manifest()
+        return outcomes
+
+
+def download_images_if_missing(
+    csv_path: Path = OFFENDER_CSV_PATH,
+    images_dir: Path = OFFENDER_IMAGES_DIR,
+    workers: int = DOWNLOAD_WORKERS,
+    revalidate: bool = False,
+) -> Counter:
+    images_dir.mkdir(parents=True, exist_ok=True)
+    if not csv_path.exists():
+        return Counter()
+    manifest_path = images_dir.parent / IMAGES_MANIFEST_PATH.name
+    migrate_name_keyed_images(csv_path, images_dir, manifest_path)
+    downloader = ImageDownloader(images_dir, manifest_path, workers)
+    outcomes = downloader.run(read_image_links(csv_path), revalidate)
+    print(
+        "Registry photos: "
+        + ", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+    )
+    return outcomes
 
 
 if __name__ == "__main__":
-    download_images_if_missing()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Download registry photos")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="re-check fetched photos with conditional GETs",
+    )
+    args = parser.parse_args()
+    download_images_if_missing(workers=args.workers, revalidate=args.revalidate)
@@ -8,56 +8,229 @@ from mediapipe.tasks import python as mp_python
 from mediapipe.tasks.python import vision as mp_vision
 from numpy.typing import NDArray
 
+from tracking import iou_matrix
+
 _FACE_DETECTOR_INSTANCE = None
 FACE_DETECTOR_MODEL_PATH = Path.cwd() / "models" / "detector.tflite"
+FACE_DETECTOR_MODEL_URL = "https://storage.googleapis.com/mediapipe-models/face_detector/blaze_face_short_range/float16/1/blaze_face_short_range.tflite"
+DETECTOR_VERSION = "blaze_face_short_range/float16/1"  # bump when crops change
 
 
-def _get_face_detector():
+def get_face_detector():
     global _FACE_DETECTOR_INSTANCE
     if _FACE_DETECTOR_INSTANCE is None:
         if not FACE_DETECTOR_MODEL_PATH.is_file():
             print("Downloading face detector model...")
             FACE_DETECTOR_MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
-            request.urlretrieve(
-                "https://storage.googleapis.com/mediapipe-models/face_detector/blaze_face_short_range/float16/1/blaze_face_short_range.tflite",
-                str(FACE_DETECTOR_MODEL_PATH),
-            )
-        base_options = mp_python.BaseOptions(model_asset_path=FACE_DETECTOR_MODEL_PATH)
+            request.urlretrieve(FACE_DETECTOR_MODEL_URL, str(FACE_DETECTOR_MODEL_PATH))
+        base_options = mp_python.BaseOptions(
+            model_asset_path=str(FACE_DETECTOR_MODEL_PATH)
+        )
         options = mp_vision.FaceDetectorOptions(base_options=base_options)
         _FACE_DETECTOR_INSTANCE = mp_vision.FaceDetector.create_from_options(options)
     return _FACE_DETECTOR_INSTANCE
 
 
-def detect_faces(img_bgr: np.ndarray) -> list[NDArray]:
-    detector = _get_face_detector()
-    if detector is None:
-        return []
+Box = tuple[int, int, int, int]  # (x1, y1, x2, y2) in pixels, exclusive end
 
-    # Convert BGR to RGB for MediaPipe
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+DETECT_MAX_SIDE = 640  # longest side of the image BlazeFace sees in live mode
+FULL_DETECT_EVERY = 5  # frames between full-frame passes when using ROIs
+ROI_MARGIN = 0.5  # ROIs grow by this fraction of the face size on each side
+MOTION_SIDE = 160  # longest side of the frame-difference thumbnail
+MOTION_THRESHOLD = 25  # gray-level change that counts as motion
+NMS_IOU = 0.5  # boxes from overlapping ROIs above this IoU are duplicates
+MAX_REGIONS = 4  # more ROIs than this cost more than one full pass
+MAX_REGION_AREA = 0.5  # ROI area, as a fraction of the frame, that does too
+
+
+def _detect_region(
+    img_bgr: np.ndarray, region: Box, max_side: int | None
+) -> list[Box]:
+    """Detect inside ``region``, downscaled so its longest side is ``max_side``."""
+    detector = get_face_detector()
+    rx1, ry1, rx2, ry2 = region
+    view = img_bgr[ry1:ry2, rx1:rx2]
+    h, w = view.shape[:2]
+    scale = min(1.0, max_side / max(h, w)) if max_side else 1.0
+    if scale < 1.0:
+        # Bilinear samples a fixed number of source pixels per output pixel,
+        # so the cost follows the detector input size, not the capture size
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        view = cv2.resize(view, size, interpolation=cv2.INTER_LINEAR)
+
+    # Convert BGR (or BGRA from in-process capture) to RGB for MediaPipe
+    code = cv2.COLOR_BGRA2RGB if view.shape[2] == 4 else cv2.COLOR_BGR2RGB
+    img_rgb = cv2.cvtColor(view, code)
     mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=img_rgb)
 
     result = detector.detect(mp_image)
     if not result.detections:
         return []
 
-    h, w, _ = img_bgr.shape
-    faces: list[np.ndarray] = []
+    boxes: list[Box] = []
     for det in result.detections:
         box = det.bounding_box
-        x1 = max(0, box.origin_x)
-        y1 = max(0, box.origin_y)
-        x2 = min(w, x1 + box.width)
-        y2 = min(h, y1 + box.height)
+        x1 = max(rx1, rx1 + int(box.origin_x / scale))
+        y1 = max(ry1, ry1 + int(box.origin_y / scale))
+        x2 = min(rx2, x1 + int(round(box.width / scale)))
+        y2 = min(ry2, y1 + int(round(box.height / scale)))
         if x2 > x1 and y2 > y1:
-            faces.append(img_bgr[y1:y2, x1:x2].copy())
-    return faces
+            boxes.append((x1, y1, x2, y2))
+    return boxes
+
+
+def _dedupe(boxes: list[Box]) -> list[Box]:
+    """Drop boxes overlapping a larger kept box by more than ``NMS_IOU``."""
+    if len(boxes) < 2:
+        return boxes
+    boxes = sorted(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]), reverse=True)
+    ious = iou_matrix(np.array(boxes, np.float32), np.array(boxes, np.float32))
+    kept: list[int] = []
+    for i in range(len(boxes)):
+        if all(ious[i, j] <= NMS_IOU for j in kept):
+            kept.append(i)
+    return [boxes[i] for i in kept]
+
+
+def detect_face_boxes(
+    img_bgr: np.ndarray,
+    max_side: int | None = None,
+    regions: list[Box] | None = None,
+) -> list[Box]:
+    """Face boxes in full-resolution coordinates, clipped to the image.
+
+    With ``max_side`` the image (or each region) is downscaled before
+    detection; with ``regions`` only those parts of the image are searched.
+    """
+    h, w = img_bgr.shape[:2]
+    if regions is None:
+        return _detect_region(img_bgr, (0, 0, w, h), max_side)
+    boxes = []
+    for region in regions:
+        boxes.extend(_detect_region(img_bgr, region, max_side))
+    return _dedupe(boxes)
+
+
+def crop_faces(img_bgr: np.ndarray, boxes: list[Box]) -> list[NDArray]:
+    """Crops as views into ``img_bgr``; valid as long as the frame is."""
+    return [img_bgr[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+
+
+def detect_faces(img_bgr: np.ndarray) -> list[NDArray]:
+    """Detect faces at full resolution and return them as crop views."""
+    return crop_faces(img_bgr, detect_face_boxes(img_bgr))
+
+
+def _expand(box: Box, margin: float, w: int, h: int) -> Box:
+    x1, y1, x2, y2 = box
+    mx, my = int((x2 - x1) * margin), int((y2 - y1) * margin)
+    return max(0, x1 - mx), max(0, y1 - my), min(w, x2 + mx), min(h, y2 + my)
+
+
+def _merge(regions: list[Box]) -> list[Box]:
+    """Union overlapping regions so no pixel is searched twice."""
+    merged: list[Box] = []
+    for r in sorted(regions):
+        for i, m in enumerate(merged):
+            if r[0] < m[2] and m[0] < r[2] and r[1] < m[3] and m[1] < r[3]:
+                merged[i] = (
+                    min(r[0], m[0]),
+                    min(r[1], m[1]),
+                    max(r[2], m[2]),
+                    max(r[3], m[3]),
+                )
+                break
+        else:
+            merged.append(r)
+    return merged if len(merged) == len(regions) else _merge(merged)
+
+
+class RegionDetector:
+    """Live-frame detection that avoids searching the whole screen every frame.
+
+    Every ``full_every`` frames the whole (downscaled) frame is searched to
+    pick up new faces. In between, only regions around the caller's known
+    faces (e.g. tracker boxes) and regions that changed since the previous
+    frame are searched, and frames with neither are skipped. When there are
+    more than ``max_regions`` regions or they cover more than
+    ``max_region_area`` of the frame, one full pass is cheaper and is used.
+    """
+
+    def __init__(
+        self,
+        max_side: int = DETECT_MAX_SIDE,
+        full_every: int = FULL_DETECT_EVERY,
+        margin: float = ROI_MARGIN,
+        max_regions: int = MAX_REGIONS,
+        max_region_area: float = MAX_REGION_AREA,
+    ):
+        self.max_side = max_side
+        self.full_every = full_every
+        self.margin = margin
+        self.max_regions = max_regions
+        self.max_region_area = max_region_area
+        self.frames = 0
+        self.full_passes = 0
+        self.roi_passes = 0
+        self.skipped = 0
+        self._prev_gray: np.ndarray | None = None
+
+    def motion_regions(self, img_bgr: np.ndarray) -> list[Box]:
+        """Bounding boxes of areas that changed since the previous frame."""
+        h, w = img_bgr.shape[:2]
+        scale = MOTION_SIDE / max(h, w)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        small = cv2.resize(img_bgr, size, interpolation=cv2.INTER_NEAREST)
+        code = cv2.COLOR_BGRA2GRAY if small.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        gray = cv2.cvtColor(small, code)
+        prev, self._prev_gray = self._prev_gray, gray
+        if prev is None or prev.shape != gray.shape:
+            return []
+        mask = (cv2.absdiff(gray, prev) > MOTION_THRESHOLD).astype(np.uint8)
+        mask = cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=2)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        return [
+            (
+                int(x / scale),
+                int(y / scale),
+                min(w, int((x + bw) / scale) + 1),
+                min(h, int((y + bh) / scale) + 1),
+            )
+            for x, y, bw, bh, _ in stats[1:n]
+        ]
+
+    def detect(self, img_bgr: np.ndarray, known: list[Box] | None = None) -> list[Box]:
+        """Face boxes in ``img_bgr``; ``known`` are boxes from the last frames."""
+        h, w = img_bgr.shape[:2]
+        motion = self.motion_regions(img_bgr)
+        full = self.frames % self.full_every == 0
+        self.frames += 1
+        if full:
+            self.full_passes += 1
+            return detect_face_boxes(img_bgr, self.max_side)
+        regions = [_expand(b, self.margin, w, h) for b in known or []] + motion
+        if not regions:
+            self.skipped += 1
+            return []
+        regions = _merge(regions)
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+        if len(regions) > self.max_regions or area > self.max_region_area * w * h:
+            self.full_passes += 1
+            return detect_face_boxes(img_bgr, self.max_side)
+        self.roi_passes += 1
+        return detect_face_boxes(img_bgr, self.max_side, regions)
+
+    def summary(self) -> str:
+        return (
+            f"Detector: {self.full_passes} full, {self.roi_passes} ROI, "
+            f"{self.skipped} skipped of {self.frames} frames"
+        )
 
 
 if __name__ == "__main__":
     import sys
 
-    _get_face_detector()
+    get_face_detector()
 
     if len(sys.argv) != 2:
         print("Usage: python detection.py <image_path>")
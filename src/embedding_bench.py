@@ -0,0 +1,219 @@
+"""Parity and speed checks for the face embedding path.
+
+``preprocess`` compares ``preprocess_faces`` with the reference PIL
+transform: input tensor difference, embedding cosine between the two paths
+and time per crop for each.
+
+``engines`` builds each inference engine and reports its build time,
+latency and throughput per batch size, and the cosine drift of its
+embeddings from the fp32 eager model.
+
+``coldstart`` times importing ``similarity`` and loading the model in fresh
+interpreters, first (optionally) rebuilding the model cache, then from it.
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+from engines import ENGINES, get_engine
+from similarity import (
+    DEFAULT_VARIANT,
+    get_edge_model,
+    model_cache_path,
+    preprocess_faces,
+    reference_preprocess,
+)
+
+IMAGES_DIR = Path.cwd() / "data" / "offender_list" / "images"
+MIN_PARITY_COSINE = 0.99  # fast-path embeddings must stay this close to _tx's
+BATCH_SIZES = (1, 4, 16, 32)
+
+
+def sample_faces(images_dir: Path | None, n: int, seed: int = 0) -> list[np.ndarray]:
+    """Up to ``n`` images from ``images_dir``, or smooth synthetic crops.
+
+    Synthetic crops have mixed sizes around the 112 px model input so both
+    the shrinking and the enlarging resize paths are exercised.
+    """
+    faces = []
+    if images_dir is not None and images_dir.is_dir():
+        for path in sorted(images_dir.iterdir())[: n * 2]:
+            image = cv2.imread(str(path))
+            if image is not None:
+                faces.append(image)
+            if len(faces) == n:
+                return faces
+    rng = np.random.default_rng(seed)
+    while len(faces) < n:
+        h, w = rng.integers(48, 320, size=2)
+        noise = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        size = (int(w), int(h))
+        faces.append(cv2.resize(noise, size, interpolation=cv2.INTER_CUBIC))
+    return faces
+
+
+def _per_crop_ms(fn, faces, repeats: int) -> float:
+    fn(faces)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(faces)
+    return 1000 * (time.perf_counter() - start) / repeats / len(faces)
+
+
+def check_preprocess(faces, variant: str = DEFAULT_VARIANT, repeats: int = 5) -> bool:
+    """Print parity and timing of the fast path; True if parity holds."""
+    reference = reference_preprocess(faces)
+    fast = preprocess_faces(faces).clone()
+    diff = (fast - reference).abs()
+    print(
+        f"Input difference over {len(faces)} crops: "
+        f"max {diff.max().item():.4f}, mean {diff.mean().item():.5f} (range [-1, 1])"
+    )
+
+    model = get_edge_model(variant)
+    device = next(model.parameters()).device
+    with torch.no_grad():
+        ref_emb = model(reference.to(device)).cpu()
+        fast_emb = model(fast.to(device)).cpu()
+    cos = torch.nn.functional.cosine_similarity(ref_emb, fast_emb)
+    print(
+        f"Embedding cosine vs _tx: min {cos.min().item():.5f}, "
+        f"mean {cos.mean().item():.5f} (bound {MIN_PARITY_COSINE})"
+    )
+
+    ref_ms = _per_crop_ms(reference_preprocess, faces, repeats)
+    fast_ms = _per_crop_ms(preprocess_faces, faces, repeats)
+    print(
+        f"Preprocessing: _tx {ref_ms:.3f} ms/crop, fast {fast_ms:.3f} ms/crop "
+        f"({ref_ms / fast_ms:.1f}x)"
+    )
+    return cos.min().item() >= MIN_PARITY_COSINE
+
+
+def bench_engines(
+    faces,
+    names=ENGINES,
+    variant: str = DEFAULT_VARIANT,
+    batch_sizes=BATCH_SIZES,
+    repeats: int = 5,
+    fold: bool = False,
+):
+    """Print build time, per-batch latency, throughput and drift per engine."""
+    inputs = preprocess_faces(faces).clone()
+    reference = get_engine("eager", variant)(inputs)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+
+    header = " ".join(f"{f'bs{b} ms':>9} {'fps':>6}" for b in batch_sizes)
+    print(f"{'engine':<14} {'build s':>7} {header} {'min cos':>8} {'mean cos':>8}")
+    for name in names:
+        try:
+            start = time.perf_counter()
+            # int8-static calibrates on registry face crops, as when deployed
+            engine = get_engine(name, variant, fold=fold)
+            build = time.perf_counter() - start
+            out = np.concatenate(
+                [engine(chunk) for chunk in inputs.split(max(batch_sizes))]
+            )
+        except Exception as e:  # missing onnxruntime, untraceable model, ...
+            print(f"{name:<14} unavailable ({type(e).__name__}: {e})")
+            continue
+        cos = (out / np.linalg.norm(out, axis=1, keepdims=True) * reference).sum(1)
+
+        cells = []
+        for bs in batch_sizes:
+            batch = inputs[:bs].repeat((bs + len(inputs) - 1) // len(inputs), 1, 1, 1)
+            batch = batch[:bs].contiguous()
+            engine(batch)  # warm-up (and compilation for this shape)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                engine(batch)
+            ms = 1000 * (time.perf_counter() - start) / repeats
+            cells.append(f"{ms:>9.2f} {1000 * bs / ms:>6.0f}")
+        print(
+            f"{name:<14} {build:>7.1f} {' '.join(cells)} "
+            f"{cos.min():>8.5f} {cos.mean():>8.5f}"
+        )
+
+
+_COLDSTART_SNIPPET = """
+import time
+start = time.perf_counter()
+from similarity import get_edge_model
+imported = time.perf_counter()
+get_edge_model({variant!r}, {fold!r})
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def coldstart(variant: str = DEFAULT_VARIANT, fold: bool = False, rebuild=False):
+    """Time import and model load in fresh processes, built and then cached."""
+    if rebuild:
+        model_cache_path(variant, fold).unlink(missing_ok=True)
+    code = _COLDSTART_SNIPPET.format(variant=variant, fold=fold)
+    src_dir = Path(__file__).resolve().parent
+    for run in ("first start", "second start"):
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=Path.cwd(),
+            env={**os.environ, "PYTHONPATH": str(src_dir)},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        lines = out.stdout.strip().splitlines()
+        import_sec, load_sec = map(float, lines[-1].split())
+        source = next((line for line in lines if line.startswith("Loaded")), "")
+        print(
+            f"{run}: import {import_sec:.2f}s + model {load_sec:.2f}s "
+            f"= {import_sec + load_sec:.2f}s ({source})"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embedding path checks")
+    parser.add_argument("command", choices=["preprocess", "engines", "coldstart"])
+    parser.add_argument("--images", type=Path, default=IMAGES_DIR)
+    parser.add_argument("--n", type=int, default=64, help="crops to test")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--variant", default=DEFAULT_VARIANT)
+    parser.add_argument(
+        "--engines", nargs="+", default=list(ENGINES), choices=ENGINES
+    )
+    parser.add_argument(
+        "--batch-sizes", nargs="+", type=int, default=list(BATCH_SIZES)
+    )
+    parser.add_argument(
+        "--fold", action="store_true", help="fold low-rank layer pairs first"
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", help="coldstart: drop the model cache"
+    )
+    args = parser.parse_args()
+
+    if args.command == "coldstart":
+        coldstart(args.variant, args.fold, args.rebuild)
+        sys.exit(0)
+    faces = sample_faces(args.images, args.n)
+    if args.command == "engines":
+        bench_engines(
+            faces,
+            args.engines,
+            args.variant,
+            args.batch_sizes,
+            args.repeats,
+            args.fold,
+        )
+    else:
+        ok = check_preprocess(faces, args.variant, args.repeats)
+        sys.exit(0 if ok else 1)
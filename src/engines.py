@@ -0,0 +1,184 @@
+"""Inference engines for the EdgeFace embedding model.
+
+Every engine maps a preprocessed ``(N, 3, 112, 112)`` float tensor to an
+``(N, 512)`` float32 array, so ``similarity.embed_faces`` can run any of them:
+
+- ``eager``: the fp32 timm model from ``get_edge_model`` (CUDA if available)
+- ``compile``: ``torch.compile`` of the eager model
+- ``int8-dynamic``: CPU, int8 weights for every Linear, activations in fp32
+- ``int8-static``: CPU, FX post-training static quantization, calibrated on
+  face crops from the registry photos unless a calibration batch is given
+- ``onnx``: exported once to ``models/<variant>.onnx``, run by ONNX Runtime
+
+With ``fold`` every engine starts from the model with its low-rank pairs
+folded (``similarity.fold_lowrank``). The gallery is always embedded with
+unfolded ``eager``; ``embedding_bench.py engines`` measures how far each
+engine drifts from it.
+"""
+
+from __future__ import annotations
+
+import copy
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from similarity import DEFAULT_VARIANT, FACE_SIZE, get_edge_model, preprocess_faces
+
+ENGINES = ("eager", "compile", "int8-dynamic", "int8-static", "onnx")
+ONNX_DIR = Path.cwd() / "models"
+ONNX_OPSET = 17
+CALIBRATION_BATCHES = 8
+CALIBRATION_IMAGES_DIR = Path.cwd() / "data" / "offender_list" / "images"
+CALIBRATION_FACES = 64
+
+_ENGINE_CACHE: dict[tuple[str, str, bool], "EmbeddingEngine"] = {}
+
+
+class EmbeddingEngine:
+    name = "engine"
+
+    def __call__(self, batch: torch.Tensor) -> np.ndarray:
+        raise NotImplementedError
+
+
+class TorchEngine(EmbeddingEngine):
+    """Runs a torch module (eager, compiled or quantized) on ``device``."""
+
+    def __init__(self, name: str, module, device: torch.device):
+        self.name = name
+        self.module = module
+        self.device = device
+
+    def __call__(self, batch):
+        with torch.inference_mode():
+            return self.module(batch.to(self.device)).float().cpu().numpy()
+
+
+class OnnxEngine(EmbeddingEngine):
+    name = "onnx"
+
+    def __init__(self, path: Path):
+        import onnxruntime as ort
+
+        self.session = ort.InferenceSession(
+            str(path), providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        feed = {self.input_name: batch.detach().cpu().numpy()}
+        return self.session.run(None, feed)[0]
+
+
+def _cpu_copy(variant: str, fold: bool) -> torch.nn.Module:
+    # Quantization and export rewrite the module, so leave the cached one alone
+    return copy.deepcopy(get_edge_model(variant, fold)).cpu().eval()
+
+
+def calibration_faces(
+    images_dir: Path = CALIBRATION_IMAGES_DIR, n: int = CALIBRATION_FACES
+) -> torch.Tensor | None:
+    """Preprocessed first faces of up to ``n`` photos spread over ``images_dir``."""
+    import cv2
+
+    from detection import detect_faces
+
+    if not images_dir.is_dir():
+        return None
+    paths = sorted(p for p in images_dir.iterdir() if p.is_file())
+    faces = []
+    for path in paths[:: max(1, len(paths) // (2 * n))]:
+        image = cv2.imread(str(path))
+        detected = detect_faces(image) if image is not None else []
+        if detected:
+            faces.append(detected[0])
+        if len(faces) == n:
+            break
+    return preprocess_faces(faces).clone() if faces else None
+
+
+def _static_int8(variant: str, fold: bool, calibration: torch.Tensor | None):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    if calibration is None:
+        calibration = calibration_faces()
+    if calibration is None:
+        raise RuntimeError(
+            f"int8-static needs face crops to calibrate on; none were found in "
+            f"{CALIBRATION_IMAGES_DIR}. Download the registry photos or pick "
+            f"another EMBED_ENGINE."
+        )
+    model = _cpu_copy(variant, fold)
+    mapping = get_default_qconfig_mapping("x86")
+    for name, _ in model.named_modules():
+        # EdgeNeXt's positional encoding reads its conv's .weight in forward,
+        # which a quantized conv turns into a method; keep it in float
+        if name.endswith("pos_embd"):
+            mapping.set_module_name(name, None)
+    example = (calibration[:1],)
+    prepared = prepare_fx(model, mapping, example)
+    with torch.inference_mode():
+        for chunk in calibration.chunk(CALIBRATION_BATCHES):
+            prepared(chunk)
+    return convert_fx(prepared)
+
+
+def export_onnx(
+    variant: str = DEFAULT_VARIANT, fold: bool = False, path: Path | None = None
+) -> Path:
+    """Export ``variant`` with a dynamic batch axis unless already exported."""
+    path = path or ONNX_DIR / f"{variant}{'-folded' if fold else ''}.onnx"
+    if not path.is_file():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torch.onnx.export(
+            _cpu_copy(variant, fold),
+            (torch.zeros(1, 3, FACE_SIZE, FACE_SIZE),),
+            str(path),
+            input_names=["input"],
+            output_names=["embedding"],
+            dynamic_axes={"input": {0: "batch"}, "embedding": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        )
+        print(f"Exported {variant} to {path}")
+    return path
+
+
+def get_engine(
+    name: str = "eager",
+    variant: str = DEFAULT_VARIANT,
+    calibration: torch.Tensor | None = None,
+    fold: bool = False,
+) -> EmbeddingEngine:
+    """Build (once) the named engine for ``variant``.
+
+    ``calibration`` is a batch of preprocessed faces used by ``int8-static``;
+    without one it calibrates on ``calibration_faces()``.
+    """
+    key = (name, variant, fold)
+    if key in _ENGINE_CACHE:
+        return _ENGINE_CACHE[key]
+
+    cpu = torch.device("cpu")
+    if name == "eager":
+        model = get_edge_model(variant, fold)
+        engine = TorchEngine(name, model, next(model.parameters()).device)
+    elif name == "compile":
+        model = get_edge_model(variant, fold)
+        device = next(model.parameters()).device
+        engine = TorchEngine(name, torch.compile(model, dynamic=True), device)
+    elif name == "int8-dynamic":
+        quantized = torch.ao.quantization.quantize_dynamic(
+            _cpu_copy(variant, fold), {torch.nn.Linear}, dtype=torch.qint8
+        )
+        engine = TorchEngine(name, quantized, cpu)
+    elif name == "int8-static":
+        engine = TorchEngine(name, _static_int8(variant, fold, calibration), cpu)
+    elif name == "onnx":
+        engine = OnnxEngine(export_onnx(variant, fold))
+    else:
+        raise ValueError(f"Unknown embedding engine '{name}'")
+    _ENGINE_CACHE[key] = engine
+    return engine
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import hashlib
+import time
+
+import numpy as np
+
+from ann import IVFIndex, top_k
+
+CODE_KINDS = ("none", "float16", "int8")
+AGGREGATES = ("max", "mean")  # how an identity's samples are scored
+CODE_RERANK = 64  # coarse-scan candidates re-scored against the float32 rows
+INT8_MAX = 127
+_SCAN_CHUNK = 256  # code rows widened to float32 at a time; stays in cache
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row of a 2D array into a contiguous float32 copy."""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def ids_digest(ids) -> str:
+    """Fingerprint of an ordered id list, used to pair indexes with galleries."""
+    h = hashlib.sha1()
+    for i in ids:
+        h.update(str(i).encode("utf-8") + b"\n")
+    return h.hexdigest()
+
+
+def encode_rows(
+    matrix: np.ndarray, kind: str
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """Coarse-scan codes for L2-normalized float32 rows.
+
+    ``float16`` halves each row but only saves memory: NumPy widens half
+    precision slowly, so scanning it is about 10x slower than float32.
+    ``int8`` stores ``round(x / s)`` with one float32 scale
+    ``s = max|x| / 127`` per row, a quarter of the size, and scans at
+    close to float32 speed.
+    Returns ``(codes, scales)``; ``scales`` is None for ``float16``.
+    """
+    if kind == "float16":
+        return matrix.astype(np.float16), None
+    if kind != "int8":
+        raise ValueError(f"Unknown code kind '{kind}'")
+    peak = np.abs(matrix).max(axis=1) if len(matrix) else np.zeros(0, np.float32)
+    scales = (np.maximum(peak, 1e-12) / INT8_MAX).astype(np.float32)
+    codes = np.rint(matrix / scales[:, None]).clip(-INT8_MAX, INT8_MAX)
+    return codes.astype(np.int8), scales
+
+
+class Gallery:
+    """All offender embeddings held as one pre-normalized float32 matrix.
+
+    Row ``i`` of ``matrix`` belongs to ``ids[i]``. A probe is scored against
+    the whole gallery with a single matrix-vector product, so per-face match
+    cost stays flat as the registry grows. With an ANN index attached only
+    the ``nprobe`` closest inverted lists are scored. With compact codes
+    attached the scan reads the codes instead, and only the best
+    ``code_rerank`` rows of ``matrix`` are touched to re-score them exactly.
+
+    With ``offsets`` an identity owns several rows: ``ids[i]`` owns rows
+    ``offsets[i]:offsets[i + 1]``. ``aggregate="mean"`` folds them into one
+    normalized template per identity; ``"max"`` keeps every sample and
+    scores an identity by its best one, one ``np.maximum.reduceat`` after
+    the matrix-vector product.
+    """
+
+    def __init__(
+        self,
+        ids,
+        matrix: np.ndarray,
+        normalized: bool = False,
+        digest: str | None = None,
+        offsets: np.ndarray | None = None,
+        aggregate: str = "max",
+    ):
+        # ids may be any indexable sequence, e.g. a memory-mapped store table
+        self.ids = np.asarray(ids, dtype=object) if isinstance(ids, list) else ids
+        self.matrix = matrix if normalized else normalize_rows(matrix)
+        self._digest = digest
+        self.offsets: np.ndarray | None = None
+        self.index: IVFIndex | None = None
+        self.nprobe = 8
+        self.rerank = 0
+        self.codes: np.ndarray | None = None
+        self.code_scales: np.ndarray | None = None
+        self.code_rerank = CODE_RERANK
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown template aggregation '{aggregate}'")
+        if offsets is not None:
+            offsets = np.asarray(offsets, dtype=np.int64)
+            if len(offsets) != len(self.ids) + 1 or offsets[-1] != len(self.matrix):
+                raise ValueError(
+                    f"Template offsets for {len(offsets) - 1} ids do not cover "
+                    f"{len(self.ids)} ids and {len(self.matrix)} rows"
+                )
+            if np.any(np.diff(offsets) <= 0):
+                raise ValueError("Every identity needs at least one row")
+            # With one sample each the rows already are the identities
+            if len(offsets) - 1 < len(self.matrix) and aggregate == "mean":
+                sums = np.add.reduceat(
+                    self.matrix, offsets[:-1], axis=0, dtype=np.float32
+                )
+                self.matrix = normalize_rows(sums)
+            elif len(offsets) - 1 < len(self.matrix):
+                self.offsets = offsets
+        if self.matrix.ndim != 2 or (
+            self.offsets is None and len(self.ids) != self.matrix.shape[0]
+        ):
+            raise ValueError(
+                f"Gallery needs one id per row, got {len(self.ids)} ids "
+                f"for a matrix of shape {self.matrix.shape}"
+            )
+
+    @classmethod
+    def from_embeddings(cls, embeddings: dict[str, np.ndarray]) -> Gallery:
+        """Build a gallery from the ``{id: embedding}`` dict format."""
+        if not embeddings:
+            return cls([], np.zeros((0, 512), dtype=np.float32), normalized=True)
+        ids = list(embeddings.keys())
+        matrix = np.stack([np.asarray(embeddings[i]).ravel() for i in ids])
+        return cls(ids, matrix)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def digest(self) -> str:
+        """Fingerprint of the id owning each row, which an index is built over."""
+        if self._digest is None:
+            owners = self.ids
+            if self.offsets is not None:
+                counts = np.diff(self.offsets)
+                owners = (self.ids[i] for i in np.repeat(np.arange(len(self)), counts))
+            self._digest = ids_digest(owners)
+        return self._digest
+
+    def attach_index(self, index: IVFIndex, nprobe: int = 8, rerank: int = 0) -> bool:
+        """Search through ``index`` from now on if it was built for these rows."""
+        if len(index) != len(self.matrix) or index.ids_digest != self.digest:
+            print("Warning: ANN index is out of date with the gallery, ignoring it.")
+            return False
+        self.index, self.nprobe, self.rerank = index, nprobe, rerank
+        return True
+
+    def attach_codes(
+        self,
+        codes: np.ndarray,
+        scales: np.ndarray | None = None,
+        rerank: int = CODE_RERANK,
+    ):
+        """Scan ``codes`` (from ``encode_rows``) instead of the float32 rows."""
+        if codes.shape != self.matrix.shape:
+            raise ValueError(
+                f"Codes of shape {codes.shape} for a gallery of {self.matrix.shape}"
+            )
+        self.codes, self.code_scales, self.code_rerank = codes, scales, rerank
+
+    @property
+    def scan_bytes_per_row(self) -> int:
+        """Bytes read per gallery row by a full scan."""
+        if self.codes is None:
+            return self.matrix.shape[1] * self.matrix.dtype.itemsize
+        scale = 0 if self.code_scales is None else self.code_scales.itemsize
+        return self.codes.shape[1] * self.codes.dtype.itemsize + scale
+
+    @staticmethod
+    def _scan(rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """``rows @ query`` in float32, widening narrower rows chunk by chunk.
+
+        A plain matmul on a float16 or int8 (memory-mapped) array would first
+        cast the whole array to float32 on every query.
+        """
+        if rows.dtype == np.float32:
+            return rows @ query
+        out = np.empty(len(rows), dtype=np.float32)
+        buf = np.empty((_SCAN_CHUNK, rows.shape[1]), dtype=np.float32)
+        for start in range(0, len(out), _SCAN_CHUNK):
+            block = rows[start : start + _SCAN_CHUNK]
+            wide = buf[: len(block)]
+            np.copyto(wide, block, casting="unsafe")
+            np.dot(wide, query, out=out[start : start + len(block)])
+        return out
+
+    def _coarse_scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine of normalized ``query`` against every code row."""
+        assert self.codes is not None
+        out = self._scan(self.codes, query)
+        if self.code_scales is not None:
+            out *= self.code_scales
+        return out
+
+    def _per_identity(self, row_scores: np.ndarray) -> np.ndarray:
+        """Best row score of each identity (a no-op with one row each)."""
+        if self.offsets is None:
+            return row_scores
+        return np.maximum.reduceat(row_scores, self.offsets[:-1])
+
+    def _exact(self, members: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Exact scores of identities ``members``, reading only their rows."""
+        if self.offsets is None:
+            return np.asarray(self.matrix[members], dtype=np.float32) @ query
+        starts = self.offsets[members]
+        counts = self.offsets[members + 1] - starts
+        local = np.cumsum(counts) - counts
+        rows = np.repeat(starts - local, counts) + np.arange(counts.sum())
+        sims = np.asarray(self.matrix[rows], dtype=np.float32) @ query
+        return np.maximum.reduceat(sims, local)
+
+    @staticmethod
+    def _normalize(probe: np.ndarray) -> np.ndarray:
+        probe = np.asarray(probe, dtype=np.float32).ravel()
+        norm = np.linalg.norm(probe)
+        return probe / norm if norm > 0 else probe
+
+    def scores(self, probe: np.ndarray) -> np.ndarray:
+        """Exact cosine similarity of ``probe`` per identity, as percentages."""
+        pct = self._per_identity(self._scan(self.matrix, self._normalize(probe)))
+        pct *= 100.0
+        return np.clip(pct, 0.0, 100.0, out=pct)
+
+    def search(self, probe: np.ndarray, k: int = 1) -> list[tuple[str, float]]:
+        """Return the top-``k`` ``(id, similarity %)`` pairs, best first.
+
+        The result is exact without an index or codes and approximate with
+        either; re-ranking makes code results exact for the rows it keeps.
+        """
+        if len(self) == 0 or k <= 0:
+            return []
+        if self.index is not None:
+            query = self._normalize(probe)
+            per_id = 1 if self.offsets is None else int(np.diff(self.offsets).max())
+            rows, sims = self.index.search(
+                query, k * per_id, self.nprobe, self.matrix, self.rerank
+            )
+            if self.offsets is not None:
+                # rows come best first, so an identity's first row is its best
+                owners = np.searchsorted(self.offsets, rows, side="right") - 1
+                _, first = np.unique(owners, return_index=True)
+                keep = np.sort(first)[:k]
+                rows, sims = owners[keep], sims[keep]
+            pct = np.clip(sims * 100.0, 0.0, 100.0)
+        elif self.codes is not None:
+            query = self._normalize(probe)
+            sims = self._per_identity(self._coarse_scores(query))
+            rows = top_k(sims, max(k, self.code_rerank))
+            sims = self._exact(rows, query) if self.code_rerank else sims[rows]
+            top = top_k(sims, k)
+            rows = rows[top]
+            pct = np.clip(sims[top] * 100.0, 0.0, 100.0)
+        else:
+            pct = self.scores(probe)
+            rows = top_k(pct, k)
+            pct = pct[rows]
+        return [(self.ids[i], float(p)) for i, p in zip(rows, pct)]
+
+
+def codes_report(
+    matrix: np.ndarray,
+    kinds=("float16", "int8"),
+    reranks=(0, 8, 32, 64),
+    n_queries: int = 200,
+    noise: float = 0.05,
+    seed: int = 0,
+):
+    """Print scan memory per identity, top-1 agreement and latency per code.
+
+    Agreement is against the exact float32 search; queries are gallery rows
+    with Gaussian noise added, as in ``ann.recall_report``.
+    """
+    matrix = normalize_rows(matrix)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(matrix), min(n_queries, len(matrix)), replace=False)
+    queries = matrix[picks] + rng.normal(0, noise, (len(picks), matrix.shape[1]))
+    queries = queries.astype(np.float32)
+
+    exact = Gallery(np.arange(len(matrix)), matrix, normalized=True)
+    t0 = time.perf_counter()
+    truth = [exact.search(q, 1)[0][0] for q in queries]
+    flat_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    print(f"Gallery: {len(matrix)} x {matrix.shape[1]}, queries: {len(queries)}")
+    print(
+        f"{'codes':<8} {'rerank':>6} {'B/identity':>10} "
+        f"{'top-1 agree':>11} {'ms/query':>9}"
+    )
+    print(
+        f"{'float32':<8} {'-':>6} {exact.scan_bytes_per_row:>10} "
+        f"{1.0:>11.3f} {flat_ms:>9.3f}"
+    )
+    for kind in kinds:
+        codes, scales = encode_rows(matrix, kind)
+        for rerank in reranks:
+            gallery = Gallery(exact.ids, matrix, normalized=True)
+            gallery.attach_codes(codes, scales, rerank)
+            t0 = time.perf_counter()
+            top1 = [gallery.search(q, 1)[0][0] for q in queries]
+            ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            agree = np.mean([a == b for a, b in zip(top1, truth)])
+            print(
+                f"{kind:<8} {rerank:>6} {gallery.scan_bytes_per_row:>10} "
+                f"{agree:>11.3f} {ms:>9.3f}"
+            )
@@ -0,0 +1,81 @@
+"""Measure how long importing each module takes and compare it to a budget.
+
+Each import runs in a fresh interpreter so module caches don't hide costs.
+Imports must stay cheap: models, logins and data files are loaded on first
+use (or by ``main.py --warmup``), never at import time.
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent
+
+# Milliseconds, including third-party imports the module cannot avoid
+# (torch for similarity and engines, mediapipe for detection).
+IMPORT_BUDGET_MS = {
+    "settings": 400,
+    "notification": 450,
+    "audio_analysis": 450,
+    "asr": 250,
+    "vad": 250,
+    "ann": 250,
+    "gallery": 250,
+    "store": 250,
+    "pipeline": 100,
+    "registry": 100,
+    "data": 600,
+    "capture": 600,
+    "tracking": 600,
+    "audio": 700,
+    "detection": 2500,
+    "similarity": 4000,
+    "engines": 4100,
+    "precompute_embeddings": 6000,
+    "main": 7000,
+}
+
+_SNIPPET = (
+    "import time; t = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def measure_import(module: str, repeats: int = 3) -> float:
+    """Best-of-``repeats`` import time of ``module`` in milliseconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-c", _SNIPPET.format(module=module)],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        best = min(best, float(out.stdout.strip().splitlines()[-1]))
+    return 1000 * best
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check module import times")
+    parser.add_argument("modules", nargs="*", default=list(IMPORT_BUDGET_MS))
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    over = 0
+    print(f"{'module':<24} {'ms':>8} {'budget':>8}")
+    for module in args.modules:
+        budget = IMPORT_BUDGET_MS.get(module, float("inf"))
+        try:
+            ms = measure_import(module, args.repeats)
+        except subprocess.CalledProcessError as e:
+            error = e.stderr.strip().splitlines()[-1] if e.stderr else e
+            print(f"{module:<24} import failed: {error}")
+            over += 1
+            continue
+        flag = "  OVER" if ms > budget else ""
+        over += ms > budget
+        print(f"{module:<24} {ms:>8.1f} {budget:>8.0f}{flag}")
+    sys.exit(1 if over else 0)
@@ -1,41 +1,47 @@
+import argparse
 import json
-import os
-import pickle
 import platform
 import subprocess as sp
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 import cv2
 import numpy as np
-import pandas as pd
-import torch
 
+from ann import INDEX_PATH, IVFIndex
 from audio import spawn_audio_detection_thread
-from data import (
-    OFFENDER_CSV_PATH,
-    OFFENDER_IMAGES_DIR,
-    download_images_if_missing,
-    make_safe_name,
-    unmake_safe_name,
+from capture import CaptureBackend, get_capture_backend
+from data import OFFENDER_CSV_PATH, download_images_if_missing, get_image_path
+from detection import RegionDetector, get_face_detector
+from engines import get_engine
+from gallery import Gallery
+from notification import get_instagram_client, send_photo_dm
+from pipeline import Pipeline, Stage
+from registry import OffenderRegistry
+from settings import load_settings, settings
+from similarity import (
+    COMPARISON_THRESHOLD,
+    DEFAULT_VARIANT,
+    PREPROCESS_VERSION,
+    embed_faces,
 )
-from detection import detect_faces
-from notification import send_photo_dm
-from settings import settings
-from similarity import COMPARISON_THRESHOLD, _tx, compare_embeddings, get_edge_model
+from store import LEGACY_PICKLE_PATH, STORE_PATH, EmbeddingStore, convert_pickle
+from tracking import MIN_EMBEDDINGS, FaceTracker
 
 OUT_DIR = Path.cwd() / "data" / "sshots"
-EMBEDDINGS_PATH = Path.cwd() / "models" / "offender_embeddings.pkl"
 TITLE_KEYWORD = "Messenger call"  # Example keyword to identify target window
 INTERVAL_SEC = 1.0
 COOLDOWN_SEC = 5 * 60  # 5 minutes cooldown between notifications
-OFFENDER_REGISTRY = pd.read_csv(OFFENDER_CSV_PATH)
+MAX_BATCH_SIZE = 16  # max face crops per EdgeFace forward pass
+EMBED_BATCH_FRAMES = 4  # queued frames whose faces are embedded together
+STATS_INTERVAL_SEC = 60.0
+WINDOW_REVALIDATE_SEC = 10.0  # re-run the window lookup at most this often
+OFFENDER_REGISTRY = OffenderRegistry(OFFENDER_CSV_PATH)  # read on first lookup
 IS_MACOS = platform.system() == "Darwin"
 
-OUT_DIR.mkdir(parents=True, exist_ok=True)
-
 
 def run(cmd):
     return sp.run(cmd, check=True, stdout=sp.PIPE, text=True).stdout
@@ -123,96 +129,68 @@ def focus_window_macos(app_name):
         sp.run(["osascript", "-e", fallback_script], check=True)
 
 
-def save_image_async(image_data: np.ndarray, path: Path):
-    """Saves image data to a file in a separate thread."""
-    threading.Thread(target=cv2.imwrite, args=(str(path), image_data)).start()
-
-
-def snap_once(geom: str) -> np.ndarray | None:
-    """Captures a screenshot and returns the image data."""
-    if IS_MACOS:
-        return snap_once_macos(geom)
-    else:
-        return snap_once_linux(geom)
-
-
-def snap_once_linux(geom: str) -> np.ndarray | None:
-    try:
-        output = sp.check_output(["grim", "-g", geom, "-"])
-        img_np = np.frombuffer(output, np.uint8)
-        return cv2.imdecode(img_np, cv2.IMREAD_COLOR)
-    except sp.CalledProcessError as e:
-        print(f"Error capturing screenshot on Linux: {e}")
-        return None
-
-
-def snap_once_macos(geom: str) -> np.ndarray | None:
-    import tempfile
+class WindowTracker:
+    """Caches the target window's address and geometry between ticks.
 
-    pos_part, size_part = geom.split(" ")
-    x, y = map(int, pos_part.split(","))
-    w, h = map(int, size_part.split("x"))
+    The lookup (a ``hyprctl`` or AppleScript subprocess) only reruns every
+    ``revalidate_sec`` or after ``invalidate()``, e.g. when a capture fails,
+    and the window is only refocused when the target changed.
+    """
 
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-        temp_path = temp_file.name
+    def __init__(self, revalidate_sec: float = WINDOW_REVALIDATE_SEC):
+        self.revalidate_sec = revalidate_sec
+        self.addr = None
+        self.geom = None
+        self._checked_at = 0.0
+        self._focused_addr = None
 
-    try:
-        cmd = ["screencapture", "-R", f"{x},{y},{w},{h}", "-o", temp_path]
+    def lookup(self):
+        now = time.monotonic()
+        if self.geom is None or now - self._checked_at >= self.revalidate_sec:
+            self.addr, self.geom = find_target()
+            self._checked_at = now
+        return self.addr, self.geom
 
-        result = sp.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"ERROR: screencapture failed with return code {result.returncode}")
-            print(f"stderr: {result.stderr}")
-            return None
+    def ensure_focus(self):
+        if self.addr is not None and self.addr != self._focused_addr:
+            focus_window(self.addr)
+            self._focused_addr = self.addr
 
-        if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
-            print("ERROR: Screenshot file is empty or was not created")
-            return None
+    def invalidate(self):
+        self.geom = None
+        self._focused_addr = None
 
-        decoded_img = cv2.imread(temp_path)
-        if decoded_img is None:
-            print("ERROR: Failed to load screenshot image")
-            return None
 
-        return decoded_img
-
-    except Exception as e:
-        print(f"Error capturing screenshot on macOS: {e}")
-        return None
-    finally:
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
+def save_image_async(image_data: np.ndarray, path: Path):
+    """Saves image data to a file in a separate thread."""
+    threading.Thread(target=cv2.imwrite, args=(str(path), image_data)).start()
 
 
 def find_match(
-    img_fromstream: np.ndarray, offender_embeddings: dict[str, np.ndarray], model
-) -> dict | None:
-    device = next(model.parameters()).device
-    with torch.no_grad():
-        live_embedding = model(_tx(img_fromstream)[None].to(device))[0].cpu().numpy()
-
-    for offender_filename, stored_embedding in offender_embeddings.items():
-        similarity = compare_embeddings(live_embedding, stored_embedding)
-        if similarity >= COMPARISON_THRESHOLD:
-            offender_name = unmake_safe_name(offender_filename)
-            print(
-                f"Found matching offender: {offender_name} with similarity {similarity:.2f}%"
-            )
-            offender_row = OFFENDER_REGISTRY[OFFENDER_REGISTRY["Name"] == offender_name]
-            if not offender_row.empty:
-                return offender_row.iloc[0].to_dict()
-            else:
-                print(f"No offender information found for {offender_name}")
-                return None
+    live_embedding: np.ndarray, gallery: Gallery
+) -> tuple[str, dict] | None:
+    """The matching offender's ID and registry row, if any."""
+    best = gallery.search(live_embedding, k=1)
+    if best and best[0][1] >= COMPARISON_THRESHOLD:
+        offender_id, similarity = best[0]
+        offender = OFFENDER_REGISTRY.get(offender_id)
+        if offender is None:
+            print(f"No offender information found for ID {offender_id}")
+            return None
+        print(
+            f"Found matching offender: {offender.get('Name')} ({offender_id}) "
+            f"with similarity {similarity:.2f}%"
+        )
+        return offender_id, offender
     print("No match found")
     return None
 
 
-def send_offender_photo_dm(offender: dict, recipient_username: str) -> bool:
+def send_offender_photo_dm(
+    offender_id: str, offender: dict, recipient_username: str
+) -> bool:
     try:
-        photo_path = (
-            OFFENDER_IMAGES_DIR / f"{make_safe_name(offender.get('Name', ''))}.jpg"
-        )
+        photo_path = get_image_path(offender_id)
         if not photo_path.exists():
             print(f"Photo not found locally: {photo_path}")
             print("Make sure to run the image download script first!")
@@ -241,17 +219,179 @@ Convictions: {offender.get("Convictions", "N/A")}
         return False
 
 
+def load_gallery() -> Gallery:
+    """Memory-map the embedding store, converting a legacy pickle if needed."""
+    if not STORE_PATH.is_file() and LEGACY_PICKLE_PATH.is_file():
+        print(f"Converting legacy embeddings '{LEGACY_PICKLE_PATH}' to '{STORE_PATH}'...")
+        convert_pickle(LEGACY_PICKLE_PATH, STORE_PATH, DEFAULT_VARIANT)
+        print(
+            "Legacy embeddings are keyed by name, not offender ID; re-run "
+            "precompute_embeddings.py so matches resolve to registry rows."
+        )
+    if not STORE_PATH.is_file():
+        print(f"Warning: Offender embeddings not found at '{STORE_PATH}'.")
+        print("Please run 'uv run src/precompute_embeddings.py' to generate them.")
+        return Gallery.from_embeddings({})
+
+    store = EmbeddingStore(STORE_PATH)
+    if store.model != DEFAULT_VARIANT or store.preprocess_version != PREPROCESS_VERSION:
+        print(
+            f"Warning: embeddings were built with {store.model} "
+            f"(preprocess v{store.preprocess_version}), expected {DEFAULT_VARIANT} "
+            f"(preprocess v{PREPROCESS_VERSION}). Re-run precompute_embeddings.py."
+        )
+    if store.identities != len(store):
+        print(
+            f"Loaded {len(store)} embeddings of {store.identities} offenders "
+            f"({settings.GALLERY_AGGREGATE} over each offender's photos)."
+        )
+    else:
+        print(f"Loaded {len(store)} offender embeddings.")
+    if store.code_kind != "none":
+        print(
+            f"Scanning {store.code_kind} codes, re-ranking the top "
+            f"{settings.CODE_RERANK} in float32."
+        )
+    return store.to_gallery(settings.CODE_RERANK, settings.GALLERY_AGGREGATE)
+
+
+def build_pipeline(
+    gallery: Gallery,
+    backend: CaptureBackend,
+    tracker: FaceTracker,
+    detector: RegionDetector,
+) -> Pipeline:
+    """Wire capture -> detect -> track/embed/match -> notify as concurrent stages."""
+    model = load_engine()
+    window = WindowTracker()
+    last_notification_time = 0.0
+
+    def capture():
+        if time.time() - last_notification_time < COOLDOWN_SEC:
+            return None
+        geom = None
+        if backend.needs_window:
+            _, geom = window.lookup()
+            if not geom:
+                print(f"Could not find window with title containing '{TITLE_KEYWORD}'")
+                return None
+            window.ensure_focus()
+        img_data = backend.grab(geom)
+        if img_data is None:
+            print("Failed to capture screenshot")
+            window.invalidate()
+            return None
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        save_image_async(img_data, OUT_DIR / f"messenger_{ts}.png")
+        return img_data
+
+    def detect(img_data):
+        # Frames without faces are still forwarded so that tracks age out
+        return img_data, detector.detect(img_data, tracker.regions())
+
+    def embed(frames):
+        # Tracks are updated frame by frame; their crops are embedded together
+        pending = [
+            pair
+            for img_data, boxes in frames
+            for pair in tracker.update(img_data, boxes)
+        ]
+        if not pending:
+            return None
+        embeddings = embed_faces([crop for _, crop in pending], model, MAX_BATCH_SIZE)
+        for (track, _), embedding in zip(pending, embeddings):
+            track.add_embedding(embedding)
+
+        offenders = []
+        for track in {track.id: track for track, _ in pending}.values():
+            if track.n_embeddings < MIN_EMBEDDINGS:
+                continue
+            match = find_match(track.mean, gallery)
+            offender_id = match[0] if match else None
+            if match and offender_id != track.offender_id:
+                offenders.append(match)  # alert once per track and identity
+            track.offender_id = offender_id
+        return offenders or None
+
+    def notify(offenders):
+        nonlocal last_notification_time
+        for offender_id, offender in offenders:
+            if time.time() - last_notification_time < COOLDOWN_SEC:
+                return
+            print("Offender details:")
+            print(offender)
+            success = send_offender_photo_dm(
+                offender_id,
+                offender,
+                recipient_username=settings.INSTAGRAM_DM_RECIPIENT,
+            )
+            if success:
+                last_notification_time = time.time()
+            else:
+                print("Failed to queue offender alert.")
+
+    return Pipeline(
+        [
+            Stage("capture", capture, interval=INTERVAL_SEC),
+            Stage("detect", detect),
+            Stage("embed", embed, batch_size=EMBED_BATCH_FRAMES, queue_size=8),
+            Stage("notify", notify, queue_size=8),
+        ]
+    )
+
+
+def load_engine():
+    return get_engine(
+        settings.EMBED_ENGINE, DEFAULT_VARIANT, fold=settings.EMBED_FOLD_LOWRANK
+    )
+
+
+def warmup():
+    """Initialize the lazily loaded services in parallel instead of on first use."""
+
+    def timed(load):
+        start = time.perf_counter()
+        load()
+        return time.perf_counter() - start
+
+    loaders = {
+        "face detector": get_face_detector,
+        "EdgeFace engine": load_engine,
+        "offender registry": OFFENDER_REGISTRY.load,
+        "Instagram login": get_instagram_client,
+    }
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(loaders)) as pool:
+        futures = {name: pool.submit(timed, load) for name, load in loaders.items()}
+        for name, future in futures.items():
+            try:
+                print(f"Warmed up {name} in {future.result():.2f}s")
+            except Exception as e:
+                print(f"Warm-up of {name} failed: {e}")
+    print(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+
 def main():
+    # Everything except --warmup is left for the settings CLI (and its --help)
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--warmup", action="store_true")
+    args, settings_args = parser.parse_known_args()
+    load_settings(settings_args)
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    pipeline = None
+    backend = None
+    tracker = None
+    detector = None
     try:
+        if args.warmup:
+            warmup()
         download_images_if_missing()
-        if not EMBEDDINGS_PATH.is_file() or EMBEDDINGS_PATH.stat().st_size == 0:
-            print(f"Warning: Offender embeddings not found at '{EMBEDDINGS_PATH}'.")
-            print("Please run 'uv run src/precompute_embeddings.py' to generate them.")
-            offender_embeddings = {}
-        else:
-            with open(EMBEDDINGS_PATH, "rb") as f:
-                offender_embeddings = pickle.load(f)
-            print(f"Loaded {len(offender_embeddings)} offender embeddings.")
+        gallery = load_gallery()
+        if INDEX_PATH.is_file() and gallery.attach_index(
+            IVFIndex.load(INDEX_PATH), settings.ANN_NPROBE, settings.ANN_RERANK
+        ):
+            print(f"Using ANN index with nprobe={settings.ANN_NPROBE}.")
 
         # Start audio monitoring in a separate thread
         audio_thread = threading.Thread(
@@ -263,53 +403,29 @@ def main():
         print(f"Starting monitoring for windows containing '{TITLE_KEYWORD}'...")
         print("Press Ctrl+C to stop.")
 
-        last_notification_time = 0
-
+        backend = get_capture_backend(
+            settings.CAPTURE_BACKEND, settings.CAPTURE_REPLAY_PATH
+        )
+        tracker = FaceTracker()
+        detector = RegionDetector()
+        pipeline = build_pipeline(gallery, backend, tracker, detector)
+        pipeline.start()
         while True:
-            current_time = time.time()
-            if current_time - last_notification_time < COOLDOWN_SEC:
-                time.sleep(INTERVAL_SEC)
-                continue
-
-            addr, geom = find_target()
-            if geom:
-                focus_window(addr)
-                img_data = snap_once(geom)
-                if img_data is not None:
-                    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                    out_path = OUT_DIR / f"messenger_{ts}.png"
-                    save_image_async(img_data, out_path)
-
-                    # Detect faces in the image
-                    faces = detect_faces(img_data)
-
-                    if faces:
-                        model = get_edge_model("edgeface_s_gamma_05")
-                        for i, face in enumerate(faces):
-                            # cv2.imshow(f"Face {i + 1}", face)
-                            # cv2.waitKey(1)
-
-                            offender = find_match(face, offender_embeddings, model)
-                            if offender is not None:
-                                print("Offender details:")
-                                print(offender)
-                                success = send_offender_photo_dm(
-                                    offender,
-                                    recipient_username=settings.INSTAGRAM_DM_RECIPIENT,
-                                )
-                                if success:
-                                    last_notification_time = time.time()
-                                else:
-                                    print("Failed to send offender alert.")
-
-                else:
-                    print("Failed to capture screenshot")
-            else:
-                print(f"Could not find window with title containing '{TITLE_KEYWORD}'")
-            time.sleep(INTERVAL_SEC)
+            time.sleep(STATS_INTERVAL_SEC)
+            pipeline.print_stats()
+            print(detector.summary())
+            print(tracker.summary())
     except KeyboardInterrupt:
         pass
     finally:
+        if pipeline is not None:
+            pipeline.stop()
+            pipeline.print_stats()
+        if detector is not None and tracker is not None:
+            print(detector.summary())
+            print(tracker.summary())
+        if backend is not None:
+            backend.close()
         cv2.destroyAllWindows()
 
 
@@ -1,22 +1,306 @@
+import heapq
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 
-from instagrapi import Client
-
 from settings import settings
 
-instagram_client = Client()
+PENDING_ALERTS_PATH = Path.cwd() / "data" / "pending_alerts.jsonl"
+COALESCE_SEC = 2.0  # alerts arriving within this window go out as one message
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SEC = 2.0  # retry delays: 2, 4, 8, ... seconds
+BACKOFF_MAX_SEC = 300.0
+ALERT_SEPARATOR = "\n\n— — —\n\n"
+
+_instagram_client = None
+_client_lock = threading.Lock()
+
+
+def get_instagram_client():
+    """Log in on first use; a failed login raises and is retried next time."""
+    global _instagram_client
+    with _client_lock:
+        if _instagram_client is None:
+            from instagrapi import Client
+
+            client = Client()
+            try:
+                client.login(settings.INSTAGRAM_USERNAME, settings.INSTAGRAM_PASSWORD)
+            except Exception as e:
+                print(f"Login failed: {e}")
+                raise
+            print("Login successful!")
+            _instagram_client = client
+    return _instagram_client
+
+
+class Transport:
+    """Where alerts are delivered; raising from any method triggers a retry."""
+
+    def resolve_user_id(self, username: str) -> int:
+        raise NotImplementedError
+
+    def send_photo(self, user_id: int, photo_path: Path):
+        raise NotImplementedError
+
+    def send_text(self, user_id: int, message: str):
+        raise NotImplementedError
+
+
+class InstagramTransport(Transport):
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        # Resolved per call so a failed login is retried with the delivery
+        return self._client or get_instagram_client()
+
+    def resolve_user_id(self, username):
+        return int(self.client.user_id_from_username(username))
+
+    def send_photo(self, user_id, photo_path):
+        self.client.direct_send_photo(photo_path, [user_id])
+
+    def send_text(self, user_id, message):
+        self.client.direct_send(message, [user_id])
+
+
+class FakeTransport(Transport):
+    """Records deliveries in memory; the first ``fail_times`` sends raise."""
+
+    def __init__(self, fail_times: int = 0):
+        self.fail_times = fail_times
+        self.lookups: list[str] = []
+        self.sent: list[tuple[int, str, str]] = []  # (user_id, kind, payload)
+
+    def _maybe_fail(self):
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise ConnectionError("fake transport failure")
+
+    def resolve_user_id(self, username):
+        self.lookups.append(username)
+        return 1000 + len(self.lookups)
+
+    def send_photo(self, user_id, photo_path):
+        self._maybe_fail()
+        self.sent.append((user_id, "photo", str(photo_path)))
+
+    def send_text(self, user_id, message):
+        self._maybe_fail()
+        self.sent.append((user_id, "text", message))
+
+
+@dataclass
+class Alert:
+    recipient: str
+    message: str
+    photo_path: str | None = None
+    photo_sent: bool = False
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class Notifier:
+    """Background alert dispatcher.
+
+    ``submit`` only enqueues, so callers never wait on the network. The
+    worker coalesces alerts that arrive within ``coalesce_sec`` into one
+    text per recipient, caches resolved user IDs and retries failures with
+    exponential backoff. A failed group waits in a retry heap rather than
+    blocking the worker, so other recipients' alerts keep flowing.
+    Undelivered alerts are kept in a JSONL file and re-queued on the next
+    start.
+    """
+
+    def __init__(
+        self,
+        transport: Transport,
+        pending_path: Path | None = PENDING_ALERTS_PATH,
+        coalesce_sec: float = COALESCE_SEC,
+        max_attempts: int = MAX_ATTEMPTS,
+        backoff_base: float = BACKOFF_BASE_SEC,
+    ):
+        self.transport = transport
+        self.pending_path = pending_path
+        self.coalesce_sec = coalesce_sec
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.delivered = 0
+        self.failed = 0
+        self._queue: queue.Queue[Alert | None] = queue.Queue()
+        self._pending: dict[str, Alert] = {}
+        self._user_ids: dict[str, int] = {}
+        # (due time, tiebreak, recipient, alerts, attempts so far)
+        self._retries: list[tuple[float, int, str, list[Alert], int]] = []
+        self._retry_seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> "Notifier":
+        for alert in self._load_pending():
+            self._pending[alert.id] = alert
+            self._queue.put(alert)
+        if self._pending:
+            print(f"Re-queued {len(self._pending)} undelivered alerts")
+        self._thread = threading.Thread(
+            target=self._run, name="notifier", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def submit(self, recipient: str, message: str, photo_path=None):
+        alert = Alert(recipient, message, str(photo_path) if photo_path else None)
+        with self._lock:
+            self._pending[alert.id] = alert
+            self._persist()
+        self._queue.put(alert)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Wait until every submitted alert is delivered or given up on."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._queue.unfinished_tasks
+
+    def _load_pending(self) -> list[Alert]:
+        if self.pending_path is None or not self.pending_path.is_file():
+            return []
+        alerts = []
+        with open(self.pending_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    alerts.append(Alert(**json.loads(line)))
+        return alerts
+
+    def _persist(self):
+        # Called with the lock held; rewritten atomically so a crash mid-write
+        # never loses the alerts that were already on disk.
+        if self.pending_path is None:
+            return
+        self.pending_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.pending_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for alert in self._pending.values():
+                f.write(json.dumps(asdict(alert)) + "\n")
+        os.replace(tmp, self.pending_path)
+
+    def _collect(self, first: Alert) -> list[Alert | None]:
+        batch: list[Alert | None] = [first]
+        deadline = time.monotonic() + self.coalesce_sec
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            if batch[-1] is None:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            while self._retries and self._retries[0][0] <= time.monotonic():
+                _, _, recipient, group, attempt = heapq.heappop(self._retries)
+                self._attempt(recipient, group, attempt)
+            timeout = None
+            if self._retries:
+                timeout = max(0.0, self._retries[0][0] - time.monotonic())
+            try:
+                first = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if first is None:
+                self._queue.task_done()
+                break
+            batch = self._collect(first)
+            alerts = [a for a in batch if a is not None]
+            by_recipient: dict[str, list[Alert]] = {}
+            for alert in alerts:
+                by_recipient.setdefault(alert.recipient, []).append(alert)
+            for recipient, group in by_recipient.items():
+                self._attempt(recipient, group, 0)
+            for _ in range(len(batch) - len(alerts)):
+                self._queue.task_done()
+        with self._lock:
+            self._persist()  # keep photo_sent progress of queued retries
+
+    def _user_id(self, recipient: str) -> int:
+        if recipient not in self._user_ids:
+            self._user_ids[recipient] = self.transport.resolve_user_id(recipient)
+        return self._user_ids[recipient]
+
+    def _deliver(self, recipient: str, group: list[Alert]):
+        user_id = self._user_id(recipient)
+        for alert in group:
+            if alert.photo_path and not alert.photo_sent:
+                self.transport.send_photo(user_id, Path(alert.photo_path))
+                alert.photo_sent = True  # not re-sent if the text fails
+        messages = [a.message for a in group if a.message]
+        if messages:
+            self.transport.send_text(user_id, ALERT_SEPARATOR.join(messages))
+
+    def _attempt(self, recipient: str, group: list[Alert], attempt: int):
+        """Try one delivery; on failure schedule a retry or give up."""
+        try:
+            self._deliver(recipient, group)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempt + 1 < self.max_attempts:
+                delay = min(self.backoff_base * 2**attempt, BACKOFF_MAX_SEC)
+                print(
+                    f"Failed to send {len(group)} alert(s) to {recipient} "
+                    f"({error}), retrying in {delay:.0f}s"
+                )
+                due = time.monotonic() + delay
+                retry = (due, next(self._retry_seq), recipient, group, attempt + 1)
+                heapq.heappush(self._retries, retry)
+                return
+            with self._lock:
+                self._persist()  # keep photo_sent progress for the next start
+            self.failed += len(group)
+            print(
+                f"Failed to send {len(group)} alert(s) to {recipient} ({error}); "
+                "giving up for now, kept for next start"
+            )
+        else:
+            with self._lock:
+                for alert in group:
+                    self._pending.pop(alert.id, None)
+                self._persist()
+            self.delivered += len(group)
+            print(f"Sent {len(group)} alert(s) to {recipient}")
+        for _ in group:
+            self._queue.task_done()
 
-try:
-    instagram_client.login(settings.INSTAGRAM_USERNAME, settings.INSTAGRAM_PASSWORD)
-    print("Login successful!")
-except Exception as e:
-    print(f"Login failed: {e}")
-    exit(1)
+
+_notifier: Notifier | None = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier() -> Notifier:
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = Notifier(InstagramTransport()).start()
+    return _notifier
 
 
 def send_photo_dm(photo_path, recipient_username, message="Check out this photo!"):
     """
-    Send a local photo via Instagram DM with an optional message
+    Queue a local photo for an Instagram DM with an optional message
 
     Args:
         photo_path (str or Path): Path to the local photo file to send
@@ -24,58 +308,26 @@ def send_photo_dm(photo_path, recipient_username, message="Check out this photo!
         message (str): Optional message to send with the photo
 
     Returns:
-        bool: True if successful, False if failed
+        bool: True if queued, False if the photo does not exist
     """
-    try:
-        # Convert to Path object and check if file exists
-        photo_file = Path(photo_path)
-        if not photo_file.exists():
-            print(f"Photo file not found: {photo_file}")
-            return False
-
-        print(f"Sending photo: {photo_file}")
-
-        user_id = int(instagram_client.user_id_from_username(recipient_username))
-        print(f"Sending photo to user ID: {user_id}")
-
-        # Send photo first
-        result = instagram_client.direct_send_photo(photo_file, [user_id])
-        print(f"Photo sent successfully! Result: {result}")
-
-        # Send text message separately if provided
-        if message:
-            instagram_client.direct_send(message, [user_id])
-            print("Message sent successfully!")
-
-        return True
-
-    except Exception as e:
-        print(f"Failed to send photo DM: {e}")
-        print(f"Error type: {type(e).__name__}")
+    photo_file = Path(photo_path)
+    if not photo_file.exists():
+        print(f"Photo file not found: {photo_file}")
         return False
+    get_notifier().submit(recipient_username, message, photo_file)
+    return True
 
 
 def send_text_dm(recipient_username, message):
     """
-    Send a text message via Instagram DM
+    Queue a text message for an Instagram DM
 
     Args:
         recipient_username (str): Instagram username of the recipient
         message (str): Message to send
 
     Returns:
-        bool: True if successful, False if failed
+        bool: True once queued
     """
-    try:
-        user_id = int(instagram_client.user_id_from_username(recipient_username))
-        print(f"Sending text message to user ID: {user_id}")
-
-        result = instagram_client.direct_send(message, [user_id])
-        print(f"Text message sent successfully! Result: {result}")
-
-        return True
-
-    except Exception as e:
-        print(f"Failed to send text message: {e}")
-        print(f"Error type: {type(e).__name__}")
-        return False
+    get_notifier().submit(recipient_username, message)
+    return True
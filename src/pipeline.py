@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+
+
+class Closed(Exception):
+    """Raised by DropOldestQueue.get once the queue is closed and drained."""
+
+
+class DropOldestQueue:
+    """Bounded FIFO whose ``put`` never blocks: when full, the oldest item is
+    evicted so consumers always see the freshest frames."""
+
+    def __init__(self, maxsize: int):
+        self._items: deque = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, max_items: int = 1) -> list:
+        """Block for at least one item and return up to ``max_items`` of them."""
+        with self._cond:
+            while not self._items:
+                if self._closed:
+                    raise Closed
+                self._cond.wait()
+            n = min(max_items, len(self._items))
+            return [self._items.popleft() for _ in range(n)]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class StageStats:
+    """Per-stage timing counters, safe to read from another thread."""
+
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.busy_sec = 0.0
+        self.max_sec = 0.0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def record(self, n_items: int, elapsed: float):
+        self.calls += 1
+        self.items += n_items
+        self.busy_sec += elapsed
+        self.max_sec = max(self.max_sec, elapsed)
+
+    def summary(self) -> str:
+        wall = time.perf_counter() - self.started
+        mean_ms = 1000 * self.busy_sec / self.calls if self.calls else 0.0
+        return (
+            f"{self.items / wall:6.2f} items/s, mean {mean_ms:7.1f} ms, "
+            f"max {1000 * self.max_sec:7.1f} ms, busy {100 * self.busy_sec / wall:5.1f}%"
+        )
+
+
+class Stage:
+    """One pipeline step running on its own thread.
+
+    A source stage (no inbox) calls ``fn()`` every ``interval`` seconds. Other
+    stages call ``fn(item)``, or ``fn(items)`` with up to ``batch_size`` queued
+    items when batching. Whatever ``fn`` returns, other than ``None``, is put
+    on the outbox for the next stage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        batch_size: int = 1,
+        interval: float = 0.0,
+        queue_size: int = 2,
+    ):
+        self.name = name
+        self.fn = fn
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue_size = queue_size
+        self.inbox: DropOldestQueue | None = None
+        self.outbox: DropOldestQueue | None = None
+        self.stats = StageStats()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _next_input(self):
+        if self.inbox is None:
+            return ()
+        items = self.inbox.get(self.batch_size)
+        return (items,) if self.batch_size > 1 else (items[0],)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                args = self._next_input()
+            except Closed:
+                break
+            start = time.perf_counter()
+            try:
+                result = self.fn(*args)
+            except Exception as e:
+                self.stats.errors += 1
+                print(f"[{self.name}] error: {e}")
+                result = None
+            elapsed = time.perf_counter() - start
+            self.stats.record(len(args[0]) if self.batch_size > 1 else 1, elapsed)
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+            if self.inbox is None and self.interval > elapsed:
+                self._stop.wait(self.interval - elapsed)
+        if self.outbox is not None:
+            self.outbox.close()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.inbox is not None:
+            self.inbox.close()
+
+    def join(self, timeout: float | None = None):
+        self._thread.join(timeout)
+
+
+class Pipeline:
+    """Stages chained by bounded drop-oldest queues.
+
+    Each stage runs concurrently, so throughput is set by the slowest stage
+    rather than the sum of all of them, and a slow consumer drops stale work
+    instead of stalling its producer.
+    """
+
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            queue = DropOldestQueue(downstream.queue_size)
+            upstream.outbox = queue
+            downstream.inbox = queue
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout: float = 5.0):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def print_stats(self):
+        for stage in self.stages:
+            dropped = stage.inbox.dropped if stage.inbox is not None else 0
+            backlog = len(stage.inbox) if stage.inbox is not None else 0
+            print(
+                f"[{stage.name:>8}] {stage.stats.summary()}, "
+                f"queued {backlog}, dropped {dropped}, errors {stage.stats.errors}"
+            )
@@ -1,44 +1,424 @@
+import hashlib
+import json
+import multiprocessing
 import os
-import pickle
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import cv2
-import torch
+import numpy as np
 
-from similarity import _tx, get_edge_model
+from ann import INDEX_PATH, IVFIndex, default_n_lists
+from detection import DETECTOR_VERSION
 from detection import detect_faces  # Import the face detection function
+from gallery import AGGREGATES, CODE_KINDS, Gallery
+from similarity import (
+    DEFAULT_VARIANT,
+    EMBEDDING_DIM,
+    PREPROCESS_VERSION,
+    embed_faces,
+    get_edge_model,
+)
+from store import STORE_PATH, EmbeddingStore, update_rows, write_store
 
 OFFENDER_IMAGES_DIR = Path.cwd() / "data" / "offender_list" / "images"
-EMBEDDINGS_PATH = Path.cwd() / "models" / "offender_embeddings.pkl"
+MANIFEST_PATH = Path.cwd() / "models" / "offender_embeddings.manifest.json"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+BATCH_SIZE = 32  # face crops per EdgeFace forward pass in pipelined mode
+PROGRESS_EVERY = 1000  # images between throughput reports
+SAMPLE_SEPARATOR = "."  # extra photos of an offender are <id>.<n>.jpg
+INDEX_DEFAULTS = {  # used until an index flag is first passed
+    "kind": "none",
+    "n_lists": None,  # default_n_lists() of the gallery size
+    "pq_m": 32,
+    "aggregate": AGGREGATES[0],
+}
 
 
-def precompute_embeddings():
-    model = get_edge_model("edgeface_s_gamma_05")
-    device = next(model.parameters()).device
+def build_index(gallery: Gallery, kind: str, n_lists: int | None, pq_m: int):
+    """Build and save an IVF (``ivf``) or IVF-PQ (``ivfpq``) index.
 
+    The index covers the rows the gallery scans: every sample with ``max``
+    aggregation, one template per identity with ``mean``.
+    """
+    matrix = np.asarray(gallery.matrix, dtype=np.float32)
+    n_lists = n_lists or default_n_lists(len(matrix))
+    print(
+        f"Building {kind} index with {n_lists} lists over {len(matrix)} embeddings..."
+    )
+    index = IVFIndex(n_lists, pq_m if kind == "ivfpq" else 0).build(
+        matrix, gallery.digest
+    )
+    index.save(INDEX_PATH)
+    print(f"Saved index to {INDEX_PATH}")
+
+
+def _build_key() -> dict:
+    """Everything besides file content that an embedding depends on."""
+    return {
+        "model": DEFAULT_VARIANT,
+        "detector_version": DETECTOR_VERSION,
+        "preprocess_version": PREPROCESS_VERSION,
+        "ids": "offender_id",  # store ids are photo stems, not file names
+    }
+
+
+def _store_id(filename: str) -> str:
+    """The store row id of a photo: its stem, ``<id>`` or ``<id>.<n>``."""
+    return Path(filename).stem
+
+
+def _identity(store_id: str) -> str:
+    """The offender ID a store row belongs to."""
+    return store_id.split(SAMPLE_SEPARATOR, 1)[0]
+
+
+def _file_hash(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def load_manifest() -> dict:
+    if MANIFEST_PATH.is_file():
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if {k: manifest.get(k) for k in _build_key()} == _build_key():
+            return manifest
+        print(
+            "Model, detector, preprocessing or ids changed; rebuilding all embeddings."
+        )
+    return {**_build_key(), "files": {}}
+
+
+def _index_settings(**flags) -> dict:
+    """Index kind and parameters: the flags passed, else the last build's."""
+    saved = {}
+    if MANIFEST_PATH.is_file():
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            saved = json.load(f).get("index", {})
+    return {
+        key: flags[key] if flags.get(key) is not None else saved.get(key, default)
+        for key, default in INDEX_DEFAULTS.items()
+    }
+
+
+def save_manifest(manifest: dict):
+    MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def scan_changes(files: dict) -> tuple[dict, list[str], list[str]]:
+    """Compare the images directory against manifest ``files`` entries.
+
+    Files whose size and mtime are unchanged are trusted without hashing.
+    Returns the refreshed entries (without a face flag for changed files),
+    the names that need embedding and the names that were deleted.
+    """
+    current, changed = {}, []
+    for entry in os.scandir(OFFENDER_IMAGES_DIR):
+        if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        st = entry.stat()
+        old = files.get(entry.name)
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            current[entry.name] = old
+            continue
+        digest = _file_hash(Path(entry.path))
+        if old and old["sha256"] == digest:
+            current[entry.name] = {**old, "mtime_ns": st.st_mtime_ns}
+            continue
+        current[entry.name] = {
+            "sha256": digest,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        changed.append(entry.name)
+    deleted = [name for name in files if name not in current]
+    return current, sorted(changed), deleted
+
+
+def _first_face(offender_filename: str) -> tuple[str, np.ndarray | None]:
+    """Decode an image and crop its first face; runs in pool workers."""
+    image = cv2.imread(str(OFFENDER_IMAGES_DIR / offender_filename))
+    if image is None:
+        return offender_filename, None
+    faces = detect_faces(image)
+    if not faces:
+        print(f"WARNING: No face detected in {offender_filename}. Skipping.")
+        return offender_filename, None
+    return offender_filename, faces[0]
+
+
+def embed_images(filenames, model) -> dict:
+    """Detect and embed the first face of each image, skipping faceless ones."""
     embeddings = {}
-    print("Generating embeddings from offender images...")
-    for offender_filename in os.listdir(OFFENDER_IMAGES_DIR):
-        if offender_filename.lower().endswith((".png", ".jpg", ".jpeg")):
-            image_path = os.path.join(OFFENDER_IMAGES_DIR, offender_filename)
-            image = cv2.imread(image_path)  
-            if image is not None:
-                faces = detect_faces(image)  
-                if not faces:
-                    print(f"WARNING: No face detected in {offender_filename}. Skipping.")
-                    continue
-                cropped_face = faces[0]
-                img_rgb = cv2.cvtColor(cropped_face, cv2.COLOR_BGR2RGB)
-                with torch.no_grad():
-                    embedding = model(_tx(img_rgb)[None].to(device))[0]
-                    embeddings[offender_filename] = embedding.cpu().numpy()
-
-    EMBEDDINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(EMBEDDINGS_PATH, "wb") as f:
-        pickle.dump(embeddings, f)
-
-    print(f"Saved {len(embeddings)} embeddings to {EMBEDDINGS_PATH}")
+    for offender_filename in filenames:
+        _, face = _first_face(offender_filename)
+        if face is not None:
+            embeddings[offender_filename] = embed_faces([face], model)[0]
+    return embeddings
+
+
+def _produce_faces(filenames, workers: int, out: queue.Queue):
+    """Decode and detect in a process pool, keeping a bounded number in flight."""
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+            pending = deque()
+            for offender_filename in filenames:
+                pending.append(pool.submit(_first_face, offender_filename))
+                if len(pending) >= out.maxsize:
+                    out.put(pending.popleft().result())
+            while pending:
+                out.put(pending.popleft().result())
+    except BaseException as e:
+        out.put(e)  # re-raised by the consumer
+        return
+    out.put(None)
+
+
+def embed_images_pipelined(
+    filenames, model, workers: int, batch_size: int = BATCH_SIZE
+) -> dict:
+    """Pipelined build: pool workers decode + detect, this thread embeds batches.
+
+    Crops flow through a bounded queue so memory stays flat however many
+    images are queued; the EdgeFace stage embeds ``batch_size`` crops at once.
+    """
+    faces_queue: queue.Queue = queue.Queue(maxsize=max(2 * workers, batch_size))
+    producer = threading.Thread(
+        target=_produce_faces, args=(filenames, workers, faces_queue), daemon=True
+    )
+    producer.start()
+
+    embeddings = {}
+    names, crops = [], []
+    done = 0
+    start = time.perf_counter()
+
+    def flush():
+        if crops:
+            for name, embedding in zip(names, embed_faces(crops, model, batch_size)):
+                embeddings[name] = embedding
+            names.clear()
+            crops.clear()
+
+    while (item := faces_queue.get()) is not None:
+        if isinstance(item, BaseException):
+            raise item
+        offender_filename, face = item
+        if face is not None:
+            names.append(offender_filename)
+            crops.append(face)
+            if len(crops) >= batch_size:
+                flush()
+        done += 1
+        if done % PROGRESS_EVERY == 0:
+            rate = done / (time.perf_counter() - start)
+            print(f"{done}/{len(filenames)} images ({rate:.1f} images/sec)")
+    flush()
+    producer.join()
+    return embeddings
+
+
+def _load_existing(manifest: dict) -> dict:
+    """Existing store rows by id, or nothing if the store does not match."""
+    if not manifest["files"] or not STORE_PATH.is_file():
+        return {}
+    store = EmbeddingStore(STORE_PATH)
+    if store.model != DEFAULT_VARIANT or store.preprocess_version != PREPROCESS_VERSION:
+        return {}
+    return {offender_id: row for row, offender_id in enumerate(store.ids)}
+
+
+def _store_layout() -> tuple[str, str]:
+    """``(dtype, codes)`` of the existing store, or the defaults without one."""
+    if not STORE_PATH.is_file():
+        return "float32", "none"
+    store = EmbeddingStore(STORE_PATH)
+    return store.header["dtype"], store.code_kind
+
+
+def precompute_embeddings(
+    index_kind=None,
+    n_lists=None,
+    pq_m=None,
+    dtype=None,
+    full=False,
+    workers=0,
+    batch_size=BATCH_SIZE,
+    codes=None,
+    aggregate=None,
+):
+    """Embed new and modified photos and update the store (and index).
+
+    ``dtype`` and ``codes`` default to the existing store's, and the index
+    kind and parameters to the last build's (kept in the manifest), so the
+    layout only changes when a flag is passed. ``aggregate`` (default
+    ``max``) must match ``GALLERY_AGGREGATE`` in the app, or the index is
+    rejected.
+    """
+    layout = _store_layout()
+    index = _index_settings(
+        kind=index_kind, n_lists=n_lists, pq_m=pq_m, aggregate=aggregate
+    )
+    built_index = _index_settings()
+    dtype, codes = dtype or layout[0], codes or layout[1]
+    manifest = {**_build_key(), "files": {}} if full else load_manifest()
+    rows = _load_existing(manifest)
+    if not rows:
+        manifest["files"] = {}
+
+    files, changed, deleted = scan_changes(manifest["files"])
+    print(
+        f"{len(files)} images: {len(changed)} new or modified, {len(deleted)} deleted."
+    )
+
+    new_embeddings = {}
+    if changed:
+        model = get_edge_model(DEFAULT_VARIANT)
+        print("Generating embeddings from offender images...")
+        start = time.perf_counter()
+        if workers > 0:
+            new_embeddings = embed_images_pipelined(changed, model, workers, batch_size)
+        else:
+            new_embeddings = embed_images(changed, model)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Embedded {len(changed)} images in {elapsed:.1f}s "
+            f"({len(changed) / elapsed:.1f} images/sec)"
+        )
+    for name in changed:
+        files[name]["face"] = name in new_embeddings
+    manifest["files"] = files
+
+    stored = [name for name in files if files[name].get("face")]
+    unchanged = [name for name in stored if name not in new_embeddings]
+    same_ids = {_store_id(name) for name in stored} == set(rows)
+    relayout = STORE_PATH.is_file() and (dtype, codes) != layout
+    dirty = bool(new_embeddings) or not same_ids or relayout
+    if not dirty and STORE_PATH.is_file():
+        print("Embeddings are up to date.")
+    elif same_ids and not relayout and STORE_PATH.is_file():
+        # Only modified images: overwrite their rows in place.
+        names = list(new_embeddings)
+        update_rows(
+            STORE_PATH,
+            [rows[_store_id(name)] for name in names],
+            np.stack([new_embeddings[name] for name in names]),
+        )
+        print(f"Updated {len(names)} embeddings in place in {STORE_PATH}")
+    else:
+        # Rows of one offender must be contiguous: order by offender ID
+        names = sorted(
+            unchanged + list(new_embeddings),
+            key=lambda name: (_identity(_store_id(name)), _store_id(name)),
+        )
+        ids = [_store_id(name) for name in names]
+        matrix = np.zeros((len(ids), EMBEDDING_DIM), dtype=np.float32)
+        kept = [i for i, name in enumerate(names) if name not in new_embeddings]
+        if kept:
+            existing = EmbeddingStore(STORE_PATH).matrix
+            matrix[kept] = existing[[rows[ids[i]] for i in kept]]
+        for i, name in enumerate(names):
+            if name in new_embeddings:
+                matrix[i] = new_embeddings[name]
+        groups = [_identity(i) for i in ids]
+        write_store(
+            STORE_PATH,
+            ids,
+            matrix,
+            DEFAULT_VARIANT,
+            PREPROCESS_VERSION,
+            dtype,
+            codes,
+            groups,
+        )
+        suffix = "" if codes == "none" else f" with {codes} scan codes"
+        print(
+            f"Saved {len(ids)} embeddings of {len(set(groups))} offenders "
+            f"to {STORE_PATH}{suffix}"
+        )
+    save_manifest(manifest)
+
+    store = EmbeddingStore(STORE_PATH)
+    if index["kind"] != "none" and len(store):
+        gallery = store.to_gallery(aggregate=index["aggregate"])
+        current = INDEX_PATH.is_file() and not dirty and index == built_index
+        if not (
+            current and IVFIndex.load(INDEX_PATH).ids_digest == gallery.digest
+        ):
+            build_index(gallery, index["kind"], index["n_lists"], index["pq_m"])
+    elif INDEX_PATH.exists():
+        INDEX_PATH.unlink()
+        print(f"Removed index {INDEX_PATH}")
+    manifest["index"] = index
+    save_manifest(manifest)
 
 
 if __name__ == "__main__":
-    precompute_embeddings()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embed offender images")
+    parser.add_argument(
+        "--index",
+        choices=["none", "ivf", "ivfpq"],
+        default=None,
+        help="ANN index to build (default: keep the last build's, else none)",
+    )
+    parser.add_argument(
+        "--n-lists", type=int, default=None, help="default: last build's, else auto"
+    )
+    parser.add_argument(
+        "--pq-m", type=int, default=None, help="default: last build's, else 32"
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "float16"],
+        default=None,
+        help="store dtype (default: keep the existing store's, else float32)",
+    )
+    parser.add_argument(
+        "--codes",
+        choices=CODE_KINDS,
+        default=None,
+        help="compact copy of the rows scanned at match time, then re-ranked; "
+        "float16 only saves memory and scans slower than float32 "
+        "(default: keep the existing store's, else none)",
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="ignore the manifest and rebuild"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="decode/detect processes for the pipelined build (0: sequential)",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--aggregate",
+        choices=AGGREGATES,
+        default=None,
+        help="how offenders with several photos are matched, which sets the "
+        "index rows; match GALLERY_AGGREGATE (default: last build's, else max)",
+    )
+    args = parser.parse_args()
+    precompute_embeddings(
+        args.index,
+        args.n_lists,
+        args.pq_m,
+        args.dtype,
+        args.full,
+        args.workers,
+        args.batch_size,
+        args.codes,
+        args.aggregate,
+    )
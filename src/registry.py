@@ -0,0 +1,95 @@
+"""Offender registry metadata keyed by a stable offender ID.
+
+The ID is the probation registration number when a row has one, otherwise
+a hash of the name and photo URL. Photos are saved as ``<id>.jpg`` and the
+embedding store uses the same IDs, so a match resolves to its registry row
+with one dict lookup.
+"""
+
+import csv
+import hashlib
+import threading
+from pathlib import Path
+
+NAME_COLUMN = "Name"
+REGISTRATION_COLUMN = "Probation Registration Number"
+
+
+def offender_id(registration: str, name: str, link: str) -> str:
+    """Filesystem-safe stable ID for a registry row."""
+    safe = "".join(c for c in registration if c.isalnum() or c in "-_")
+    if safe:
+        return safe
+    digest = hashlib.sha1(f"{name}\n{link}".encode("utf-8")).hexdigest()
+    return f"h{digest[:16]}"
+
+
+def read_registry(csv_path: Path) -> tuple[list[str], list[tuple[str, list[str]]]]:
+    """Return the CSV header and ``(offender_id, row)`` for every named row.
+
+    The name is the first column and the photo URL the second. Rows whose ID
+    was already seen are dropped, since they would share one photo file.
+    """
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        reg = header.index(REGISTRATION_COLUMN) if REGISTRATION_COLUMN in header else None
+        rows, seen, duplicates = [], set(), 0
+        for row in reader:
+            if not row or not row[0].strip():
+                continue
+            link = row[1].strip() if len(row) > 1 else ""
+            registration = row[reg].strip() if reg is not None and reg < len(row) else ""
+            oid = offender_id(registration, row[0].strip(), link)
+            if oid in seen:
+                duplicates += 1
+                continue
+            seen.add(oid)
+            rows.append((oid, row))
+    if duplicates:
+        print(f"Warning: skipped {duplicates} registry rows with a duplicate ID")
+    return header, rows
+
+
+class OffenderRegistry:
+    """Registry rows by offender ID, parsed from the CSV on first use.
+
+    Each row is a tuple against one shared column list, with repeated values
+    (status, tier, eye colour, ...) stored once, so memory stays close to
+    the CSV's size and a lookup costs the same for any registry size.
+    """
+
+    def __init__(self, csv_path: Path):
+        self.csv_path = csv_path
+        self.columns: tuple[str, ...] = ()
+        self._rows: dict[str, tuple[str, ...]] | None = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, tuple[str, ...]]:
+        with self._lock:
+            if self._rows is None:
+                self._rows = self._read()
+            return self._rows
+
+    def _read(self) -> dict[str, tuple[str, ...]]:
+        rows: dict[str, tuple[str, ...]] = {}
+        if not self.csv_path.is_file():
+            return rows
+        header, records = read_registry(self.csv_path)
+        self.columns = tuple(header)
+        values: dict[str, str] = {}
+        for oid, row in records:
+            row = row + [""] * (len(header) - len(row))
+            rows[oid] = tuple(values.setdefault(v, v) for v in row)
+        return rows
+
+    def get(self, offender_id: str) -> dict | None:
+        """The row for ``offender_id`` as a column -> value dict, if known."""
+        row = self.load().get(offender_id)
+        return None if row is None else dict(zip(self.columns, row))
+
+    def __contains__(self, offender_id: str) -> bool:
+        return offender_id in self.load()
+
+    def __len__(self) -> int:
+        return len(self.load())
@@ -1,3 +1,5 @@
+import threading
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -5,13 +7,16 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class AppSettings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env",
-        cli_parse_args=True,
         extra="ignore",
     )
 
     TOGETHER_API_KEY: str | None = Field(
         default=None, description="API key for Together"
     )
+    TOGETHER_BASE_URL: str = Field(
+        default="https://api.together.xyz/v1",
+        description="OpenAI-compatible endpoint for the threat LLM",
+    )
     INSTAGRAM_USERNAME: str | None = Field(
         default=None, description="Instagram username for login"
     )
@@ -22,6 +27,67 @@ class AppSettings(BaseSettings):
     TITLE_KEYWORD: str = Field(
         default="Messenger call", description="Keyword to identify target window"
     )
+    CAPTURE_BACKEND: str = Field(
+        default="auto", description="Screen capture: auto, mss, subprocess or replay"
+    )
+    CAPTURE_REPLAY_PATH: str | None = Field(
+        default=None, description="Video file or image directory for replay capture"
+    )
+    ASR_BACKEND: str = Field(
+        default="whisper",
+        description="Speech-to-text: whisper, whisper-int8 or faster-whisper",
+    )
+    ASR_MODEL_SIZE: str = Field(
+        default="small", description="Whisper model size (tiny, base, small, ...)"
+    )
+    EMBED_ENGINE: str = Field(
+        default="eager",
+        description="Face embedding engine: eager, compile, int8-dynamic, "
+        "int8-static or onnx",
+    )
+    EMBED_FOLD_LOWRANK: bool = Field(
+        default=False,
+        description="Merge EdgeFace low-rank layer pairs where that is faster",
+    )
+    ANN_NPROBE: int = Field(
+        default=8, description="Inverted lists scanned per ANN query (recall knob)"
+    )
+    ANN_RERANK: int = Field(
+        default=64, description="PQ candidates re-scored exactly per ANN query"
+    )
+    GALLERY_AGGREGATE: str = Field(
+        default="max",
+        description="Matching offenders with several photos: max (best photo) "
+        "or mean (one averaged template)",
+    )
+    CODE_RERANK: int = Field(
+        default=64,
+        description="Candidates from a float16/int8 code scan re-scored in float32",
+    )
+
+
+_settings: AppSettings | None = None
+_settings_lock = threading.Lock()
+
+
+def load_settings(cli_args: list[str] | bool = False) -> AppSettings:
+    """Build the settings once, from ``.env``, the environment and ``cli_args``.
+
+    Only the first call's ``cli_args`` count, so ``main`` calls this before
+    anything else reads a setting; tools that never do are not handed argv.
+    """
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = AppSettings(_cli_parse_args=cli_args)  # pyright: ignore[reportCallIssue]
+    return _settings
+
+
+class _LazySettings:
+    """Stands in for AppSettings until a field is first read."""
+
+    def __getattr__(self, name):
+        return getattr(load_settings(), name)
 
 
-settings = AppSettings()  # pyright: ignore[reportCallIssue]
+settings: AppSettings = _LazySettings()  # pyright: ignore[reportAssignmentType]
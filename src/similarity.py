@@ -1,6 +1,14 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
 import cv2
+import numpy as np
 import timm
 import torch
 import torch.nn as nn
@@ -9,35 +17,42 @@ from huggingface_hub import hf_hub_download
 from torchvision import transforms
 
 _EDGE_MODEL_CACHE: dict[str, torch.nn.Module] = {}
+EMBEDDING_DIM = 512
+DEFAULT_VARIANT = "edgeface_s_gamma_05"
+FACE_SIZE = 112
+PREPROCESS_VERSION = 2  # bump when preprocessing changes; stored embeddings rebuild
+MODEL_CACHE_DIR = Path.cwd() / "models" / "cache"
+FOLD_BATCH_SIZE = 4  # batch size folding decisions are timed at
+FOLD_REPEATS = 20
 
 model_configs = {
     "edgeface_base": {
         "repo": "idiap/EdgeFace-Base",
         "filename": "edgeface_base.pt",
         "timm_model": "edgenext_base",
-        "post_setup": lambda x: x,
+        "rank_ratio": None,
     },
     "edgeface_s_gamma_05": {
         "repo": "idiap/EdgeFace-S-GAMMA",
         "filename": "edgeface_s_gamma_05.pt",
         "timm_model": "edgenext_small",
-        "post_setup": lambda x: replace_linear_with_lowrank_2(x, rank_ratio=0.5),
+        "rank_ratio": 0.5,
     },
     "edgeface_xs_gamma_06": {
         "repo": "idiap/EdgeFace-XS-GAMMA",
         "filename": "edgeface_xs_gamma_06.pt",
         "timm_model": "edgenext_x_small",
-        "post_setup": lambda x: replace_linear_with_lowrank_2(x, rank_ratio=0.6),
+        "rank_ratio": 0.6,
     },
     "edgeface_xxs": {
         "repo": "idiap/EdgeFace-XXS",
         "filename": "edgeface_xxs.pt",
         "timm_model": "edgenext_xx_small",
-        "post_setup": lambda x: x,
+        "rank_ratio": None,
     },
 }
 
-# FIXED: proper preprocessing
+# Reference PIL pipeline; embed_faces uses the equivalent preprocess_faces
 _tx = transforms.Compose(
     [
         transforms.ToPILImage(),
@@ -84,37 +99,154 @@ class TimmFRWrapperV2(nn.Module):
         return self.model(x)
 
 
-def get_edge_model(name: str) -> torch.nn.Module:
-    if name in _EDGE_MODEL_CACHE:
-        return _EDGE_MODEL_CACHE[name]
-
-    if name not in model_configs:
-        raise KeyError(f"Unknown edge model '{name}'")
-
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+def _time_module(module: nn.Module, x: torch.Tensor) -> float:
+    with torch.no_grad():
+        module(x)  # warm-up
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(FOLD_REPEATS):
+            module(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def fold_lowrank(model: nn.Module, batch_size: int = FOLD_BATCH_SIZE) -> int:
+    """Merge ``LoRaLin`` pairs into one ``nn.Linear`` where that runs faster.
+
+    The merged weight is ``W2 @ W1``, so outputs only change by rounding.
+    Each pair is timed both ways on the input shape it sees for a batch of
+    ``batch_size`` faces; folding wins for square layers (one matmul
+    instead of two) but can lose for wide MLP layers. Returns the number
+    of folded pairs.
+    """
+    parents = [
+        (parent, name, child)
+        for parent in model.modules()
+        for name, child in parent.named_children()
+        if isinstance(child, LoRaLin)
+    ]
+    if not parents:
+        return 0
+    device = next(model.parameters()).device
+    shapes: dict[nn.Module, torch.Size] = {}
+    hooks = [
+        child.register_forward_hook(
+            lambda mod, inp, out: shapes.setdefault(mod, inp[0].shape)
+        )
+        for _, _, child in parents
+    ]
+    with torch.no_grad():
+        model(torch.zeros(batch_size, 3, FACE_SIZE, FACE_SIZE, device=device))
+    for hook in hooks:
+        hook.remove()
+
+    folded = 0
+    for parent, name, child in parents:
+        linear1, linear2 = child.linear1, child.linear2
+        fused = nn.Linear(
+            linear1.in_features, linear2.out_features, bias=linear2.bias is not None
+        ).to(device)
+        with torch.no_grad():
+            fused.weight.copy_(linear2.weight @ linear1.weight)
+            if linear2.bias is not None:
+                fused.bias.copy_(linear2.bias)
+        if child not in shapes:
+            continue  # not on the forward path
+        x = torch.randn(shapes[child], device=device)
+        if _time_module(fused, x) < _time_module(child, x):
+            setattr(parent, name, fused)
+            folded += 1
+    return folded
+
+
+def _checkpoint_path(name: str) -> Path:
+    """The local checkpoint file, downloaded from the hub only if missing."""
     cfg = model_configs[name]
-    model_path = hf_hub_download(
+    path = Path("models") / cfg["filename"]
+    if path.is_file():
+        return path.resolve()
+    path = hf_hub_download(
         repo_id=cfg["repo"], filename=cfg["filename"], local_dir="models"
     )
+    return Path(path)
+
+
+def _build_edge_model(name: str, model_path: Path) -> torch.nn.Module:
+    cfg = model_configs[name]
     model = TimmFRWrapperV2(cfg["timm_model"])
-    model = cfg["post_setup"](model)
+    if cfg["rank_ratio"]:
+        model = replace_linear_with_lowrank_2(model, rank_ratio=cfg["rank_ratio"])
 
     state = torch.load(model_path, map_location="cpu")
     missing, unexpected = model.load_state_dict(state, strict=False)
     if missing or unexpected:
         print(f"[warn] Missing: {missing} | Unexpected: {unexpected}")
+    return model
+
+
+def model_cache_path(name: str, fold: bool, model_path: Path | None = None) -> Path:
+    """Cache file for the library versions, model config and checkpoint used.
+
+    The checkpoint is identified by its size and mtime, which change whenever
+    a new file replaces it.
+    """
+    model_path = model_path or _checkpoint_path(name)
+    st = model_path.stat()
+    key = json.dumps(
+        [model_configs[name], st.st_size, st.st_mtime_ns], sort_keys=True
+    )
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    tag = f"torch{torch.__version__}-timm{timm.__version__}".replace("+", "_")
+    return MODEL_CACHE_DIR / f"{name}{'-folded' if fold else ''}-{tag}-{digest}.pt"
+
+
+def get_edge_model(name: str, fold: bool = False) -> torch.nn.Module:
+    """The weight-loaded EdgeFace model, optionally with low-rank pairs folded.
+
+    The first build is pickled to ``MODEL_CACHE_DIR``; later processes load
+    that instead of building the timm model and loading the state dict. The
+    checkpoint is resolved locally without contacting the hub once it has
+    been downloaded; replacing it or changing the config gets a new cache
+    file.
+    """
+    key = f"{name}:folded" if fold else name
+    if key in _EDGE_MODEL_CACHE:
+        return _EDGE_MODEL_CACHE[key]
+
+    if name not in model_configs:
+        raise KeyError(f"Unknown edge model '{name}'")
+
+    start = time.perf_counter()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model_path = _checkpoint_path(name)
+    cache_path = model_cache_path(name, fold, model_path)
+    if cache_path.is_file():
+        # Written by this function below, so unpickling it is trusted
+        model = torch.load(cache_path, map_location="cpu", weights_only=False)
+        source = "cache"
+    else:
+        model = _build_edge_model(name, model_path).eval().to(device)
+        if fold:
+            print(f"Folded {fold_lowrank(model)} low-rank layer pairs")
+        source = "hub weights"
+        # Pickled classes must be importable as ``similarity.*`` to load again
+        if LoRaLin.__module__ != "__main__":
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_path.with_suffix(".tmp")
+            torch.save(model.cpu(), tmp)
+            os.replace(tmp, cache_path)
 
     model.eval().to(device)
-    _EDGE_MODEL_CACHE[name] = model
+    print(f"Loaded {key} from {source} in {time.perf_counter() - start:.2f}s")
+    _EDGE_MODEL_CACHE[key] = model
     return model
 
 
-def compare(img_left, img_right, variant="edgeface_s_gamma_05") -> float:
-    mdl = get_edge_model(variant)
-    dev = next(mdl.parameters()).device
-    with torch.no_grad():
-        ea = mdl(_tx(cv2.cvtColor(img_left, cv2.COLOR_BGR2RGB))[None].to(dev))[0]
-        eb = mdl(_tx(cv2.cvtColor(img_right, cv2.COLOR_BGR2RGB))[None].to(dev))[0]
+def compare(img_left, img_right, variant=DEFAULT_VARIANT) -> float:
+    embeddings = embed_faces([img_left, img_right], get_edge_model(variant))
+    ea, eb = torch.from_numpy(embeddings)
     pct = float(F.cosine_similarity(ea[None], eb[None]).item() * 100)
     pct = max(0, min(100, pct))
     print(f"Similarity: {pct:.2f}%")
@@ -145,7 +277,92 @@ def compare_embeddings(embedding1, embedding2) -> float:
     return pct
 
 
-def get_face_encodings(img_bgr, variant="edgeface_s_gamma_05"):
+class FacePreprocessor:
+    """OpenCV/torch replacement for ``_tx`` writing into reused buffers.
+
+    Each crop is resized with ``cv2.resize`` straight into a uint8 NHWC
+    batch and converted to RGB in place; the batch is then scaled to
+    [-1, 1] (``x / 127.5 - 1``, i.e. ToTensor plus Normalize(0.5, 0.5)) in
+    one fused pass into a preallocated NCHW float tensor. Buffers only grow,
+    so steady-state batches allocate nothing.
+    """
+
+    def __init__(self, size: int = FACE_SIZE):
+        self.size = size
+        self._pixels = np.empty((0, size, size, 3), dtype=np.uint8)
+        self._tensor = torch.empty((0, 3, size, size), dtype=torch.float32)
+
+    def __call__(self, faces) -> torch.Tensor:
+        """Preprocess BGR/BGRA crops; the result is reused by the next call."""
+        n, size = len(faces), self.size
+        if n > len(self._pixels):
+            self._pixels = np.empty((n, size, size, 3), dtype=np.uint8)
+            self._tensor = torch.empty((n, 3, size, size), dtype=torch.float32)
+        for face, dst in zip(faces, self._pixels):
+            h, w = face.shape[:2]
+            # Area averaging when shrinking approximates PIL's antialiased resize
+            shrink = h > size or w > size
+            interp = cv2.INTER_AREA if shrink else cv2.INTER_LINEAR
+            if face.shape[2] == 4:
+                small = cv2.resize(face, (size, size), interpolation=interp)
+                cv2.cvtColor(small, cv2.COLOR_BGRA2RGB, dst=dst)
+            else:
+                cv2.resize(face, (size, size), dst=dst, interpolation=interp)
+                cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst=dst)
+        pixels = torch.from_numpy(self._pixels[:n]).permute(0, 3, 1, 2)
+        out = self._tensor[:n]
+        out.copy_(pixels)
+        return out.mul_(1 / 127.5).sub_(1.0)
+
+
+def reference_preprocess(faces) -> torch.Tensor:
+    """The original per-crop PIL path, kept to check preprocess_faces against."""
+    rgb = [
+        cv2.cvtColor(f, cv2.COLOR_BGRA2RGB if f.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+        for f in faces
+    ]
+    return torch.stack([_tx(f) for f in rgb])
+
+
+_preprocessors = threading.local()
+
+
+def preprocess_faces(faces) -> torch.Tensor:
+    """``(N, 3, 112, 112)`` model input for BGR crops, from a per-thread buffer."""
+    if not hasattr(_preprocessors, "default"):
+        _preprocessors.default = FacePreprocessor()
+    return _preprocessors.default(faces)
+
+
+def embed_faces(faces, model, max_batch_size: int | None = None) -> np.ndarray:
+    """Embed BGR face crops in batched forward passes, returning an (N, 512) array.
+
+    ``model`` is an EdgeFace module or any engine from ``engines.get_engine``.
+
+    All crops are preprocessed into one tensor and run through the model
+    together, split into chunks of at most ``max_batch_size`` if given.
+    """
+    if len(faces) == 0:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+    if isinstance(model, nn.Module):
+        device = next(model.parameters()).device
+
+        def run(batch):
+            return model(batch.to(device)).cpu().numpy()
+
+    else:
+        run = model  # an engines.EmbeddingEngine, already returns NumPy
+
+    step = max_batch_size or len(faces)
+    chunks = []
+    with torch.no_grad():
+        for start in range(0, len(faces), step):
+            chunks.append(run(preprocess_faces(faces[start : start + step])))
+    return np.concatenate(chunks)
+
+
+def get_face_encodings(img_bgr, variant=DEFAULT_VARIANT, max_batch_size=None):
     """Extract face encodings from detected faces in an image."""
     from detection import detect_faces
 
@@ -154,16 +371,7 @@ def get_face_encodings(img_bgr, variant="edgeface_s_gamma_05"):
         return []
 
     model = get_edge_model(variant)
-    device = next(model.parameters()).device
-    encodings = []
-
-    with torch.no_grad():
-        for face in faces:
-            img_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-            encoding = model(_tx(img_rgb)[None].to(device))[0].cpu().numpy()
-            encodings.append(encoding)
-
-    return encodings
+    return list(embed_faces(faces, model, max_batch_size))
 
 
 def compare_faces(known_embeddings, face_encoding, tolerance=COMPARISON_THRESHOLD):
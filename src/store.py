@@ -0,0 +1,416 @@
+"""Versioned on-disk embedding store that is memory-mapped at runtime.
+
+Layout::
+
+    MAGIC (8 bytes) | header length (uint32 LE) | JSON header | padding
+    matrix   (count x dim, float32 or float16, rows L2-normalized)
+    codes    (optional, count x dim, float16 or int8 coarse-scan codes)
+    code_scales (int8 codes only, count, float32)
+    id_offsets (count + 1, int64)
+    id_blob  (UTF-8 ids, concatenated)
+    identity_offsets (optional, identities + 1, int64: rows of each identity)
+    identity_id_offsets, identity_id_blob (identity ids, as for the row ids)
+
+Every section starts on a 64-byte boundary; the header records each section
+as ``[offset, nbytes]`` along with the model name and preprocessing version
+that produced the embeddings. With codes the matcher scans them and reads
+only its re-rank candidates from ``matrix``, so most of the matrix stays on
+disk.
+
+Row ids name the photo a row was embedded from. With several photos per
+person, ``groups`` gives each row's identity; an identity's rows are
+contiguous, so its template is the slice between two ``identity_offsets``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import struct
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from gallery import (
+    CODE_KINDS,
+    CODE_RERANK,
+    Gallery,
+    codes_report,
+    encode_rows,
+    ids_digest,
+    normalize_rows,
+)
+
+STORE_PATH = Path.cwd() / "models" / "offender_embeddings.evs"
+LEGACY_PICKLE_PATH = Path.cwd() / "models" / "offender_embeddings.pkl"
+MAGIC = b"EVADEEMB"
+FORMAT_VERSION = 1
+LEGACY_PREPROCESS_VERSION = 1  # pickles were embedded through the PIL _tx path
+ALIGN = 64
+_WRITE_CHUNK = 65_536  # rows normalized and written at a time
+_CODE_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+class IdTable:
+    """Read-only sequence of ids backed by the memory-mapped id sections."""
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i) -> str:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _pad(f):
+    f.write(b"\0" * (-f.tell() % ALIGN))
+
+
+def _encode_ids(ids: list[str]) -> tuple[np.ndarray, bytes]:
+    encoded = [i.encode("utf-8") for i in ids]
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, b"".join(encoded)
+
+
+def _group_runs(groups: list[str]) -> tuple[list[str], np.ndarray]:
+    """Identities in row order and the row offset where each one starts."""
+    starts = [i for i in range(len(groups)) if i == 0 or groups[i] != groups[i - 1]]
+    identities = [groups[i] for i in starts]
+    if len(set(identities)) != len(identities):
+        raise ValueError("Rows of an identity must be contiguous")
+    return identities, np.array(starts + [len(groups)], dtype=np.int64)
+
+
+def write_store(
+    path: Path,
+    ids,
+    matrix: np.ndarray,
+    model: str,
+    preprocess_version: int,
+    dtype: str = "float32",
+    codes: str = "none",
+    groups=None,
+):
+    """Atomically write ``matrix`` (rows normalized on the way) and ``ids``.
+
+    ``codes`` adds a ``float16`` or ``int8`` copy of the rows for scanning;
+    ``float16`` codes save memory only, ``int8`` ones also scan fast.
+    ``groups`` is the identity of each row, for identities with several.
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"Unsupported store dtype '{dtype}'")
+    if codes not in CODE_KINDS:
+        raise ValueError(f"Unsupported store codes '{codes}'")
+    ids = [str(i) for i in ids]
+    count, dim = (len(ids), matrix.shape[1]) if len(ids) else (0, matrix.shape[-1])
+    if matrix.shape[0] != count:
+        raise ValueError(f"{count} ids for {matrix.shape[0]} embeddings")
+
+    id_offsets, id_blob = _encode_ids(ids)
+    if groups is not None:
+        groups = [str(g) for g in groups]
+        if len(groups) != count:
+            raise ValueError(f"{len(groups)} groups for {count} rows")
+        identities, identity_offsets = _group_runs(groups)
+        identity_id_offsets, identity_id_blob = _encode_ids(identities)
+
+    # Section offsets depend on the header length, so lay out with the final
+    # header size: grow the reserved space until the offsets fit.
+    header = {
+        "format_version": FORMAT_VERSION,
+        "model": model,
+        "preprocess_version": preprocess_version,
+        "dtype": dtype,
+        "code_kind": codes,
+        "count": count,
+        "dim": dim,
+        "normalized": True,
+        "ids_digest": ids_digest(ids),
+    }
+    if groups is not None:
+        # What Gallery.digest comes to for each aggregation, for ANN pairing
+        header["identities"] = len(identities)
+        header["template_digests"] = {
+            "max": ids_digest(groups),
+            "mean": ids_digest(identities),
+        }
+    itemsize = np.dtype(dtype).itemsize
+    sizes = {"matrix": count * dim * itemsize}
+    if codes != "none":
+        sizes["codes"] = count * dim * np.dtype(_CODE_DTYPES[codes]).itemsize
+    if codes == "int8":
+        sizes["code_scales"] = count * 4
+    sizes |= {
+        "id_offsets": id_offsets.nbytes,
+        "id_blob": len(id_blob),
+    }
+    if groups is not None:
+        sizes |= {
+            "identity_offsets": identity_offsets.nbytes,
+            "identity_id_offsets": identity_id_offsets.nbytes,
+            "identity_id_blob": len(identity_id_blob),
+        }
+    reserved = 0
+    while True:
+        offset = _align(len(MAGIC) + 4 + reserved)
+        for name, nbytes in sizes.items():
+            header[name] = [offset, nbytes]
+            offset = _align(offset + nbytes)
+        raw = json.dumps(header).encode("utf-8")
+        if len(raw) <= reserved:
+            break
+        reserved = len(raw)
+    raw = raw.ljust(reserved)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(raw)))
+            f.write(raw)
+            _pad(f)
+            for start in range(0, count, _WRITE_CHUNK):
+                block = normalize_rows(matrix[start : start + _WRITE_CHUNK])
+                f.write(block.astype(dtype, copy=False).tobytes())
+            _pad(f)
+            if codes != "none":
+                scales = []
+                for start in range(0, count, _WRITE_CHUNK):
+                    block = normalize_rows(matrix[start : start + _WRITE_CHUNK])
+                    block_codes, block_scales = encode_rows(block, codes)
+                    f.write(block_codes.tobytes())
+                    scales.append(block_scales)
+                _pad(f)
+                if codes == "int8":
+                    for block_scales in scales:
+                        f.write(block_scales.tobytes())
+                    _pad(f)
+            f.write(id_offsets.tobytes())
+            _pad(f)
+            f.write(id_blob)
+            if groups is not None:
+                _pad(f)
+                f.write(identity_offsets.tobytes())
+                _pad(f)
+                f.write(identity_id_offsets.tobytes())
+                _pad(f)
+                f.write(identity_id_blob)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _align(n: int) -> int:
+    return n + (-n % ALIGN)
+
+
+def update_rows(path: Path, rows, matrix: np.ndarray):
+    """Overwrite existing ``rows`` of a store (and their codes) in place."""
+    store = EmbeddingStore(path)
+    rows = np.asarray(rows, dtype=np.int64)
+    matrix = normalize_rows(matrix)
+    updates = [("matrix", store.header["dtype"], matrix)]
+    if store.code_kind != "none":
+        codes, scales = encode_rows(matrix, store.code_kind)
+        updates.append(("codes", _CODE_DTYPES[store.code_kind], codes))
+        if scales is not None:
+            updates.append(("code_scales", np.float32, scales))
+    for name, dtype, values in updates:
+        offset, _ = store.header[name]
+        shape = (store.count, store.dim) if values.ndim == 2 else (store.count,)
+        target = np.memmap(path, dtype=dtype, mode="r+", offset=offset, shape=shape)
+        target[rows] = values
+        target.flush()
+        del target
+
+
+class EmbeddingStore:
+    """Memory-mapped view of a store file; opening cost is independent of size."""
+
+    def __init__(self, path: Path = STORE_PATH):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not an embedding store")
+            (length,) = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(length))
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported store format {self.header['format_version']} "
+                f"(expected {FORMAT_VERSION})"
+            )
+        self.matrix = self._section("matrix", self.header["dtype"]).reshape(
+            self.count, self.dim
+        )
+        self.ids = IdTable(
+            self._section("id_offsets", np.int64), self._section("id_blob", np.uint8)
+        )
+        self.codes: np.ndarray | None = None
+        self.code_scales: np.ndarray | None = None
+        if self.code_kind != "none":
+            self.codes = self._section(
+                "codes", _CODE_DTYPES[self.code_kind]
+            ).reshape(self.count, self.dim)
+        if self.code_kind == "int8":
+            self.code_scales = self._section("code_scales", np.float32)
+        self.identity_offsets: np.ndarray | None = None
+        self.identity_ids: IdTable | None = None
+        if "identity_offsets" in self.header:
+            self.identity_offsets = self._section("identity_offsets", np.int64)
+            self.identity_ids = IdTable(
+                self._section("identity_id_offsets", np.int64),
+                self._section("identity_id_blob", np.uint8),
+            )
+
+    def _section(self, name: str, dtype) -> np.ndarray:
+        offset, nbytes = self.header[name]
+        if nbytes == 0:
+            return np.zeros(0, dtype=dtype)
+        count = nbytes // np.dtype(dtype).itemsize
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=count)
+
+    @property
+    def count(self) -> int:
+        return self.header["count"]
+
+    @property
+    def dim(self) -> int:
+        return self.header["dim"]
+
+    @property
+    def identities(self) -> int:
+        return self.header.get("identities", self.count)
+
+    @property
+    def code_kind(self) -> str:
+        return self.header.get("code_kind", "none")  # absent in older stores
+
+    @property
+    def model(self) -> str:
+        return self.header["model"]
+
+    @property
+    def preprocess_version(self) -> int:
+        return self.header["preprocess_version"]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def to_gallery(self, rerank: int = CODE_RERANK, aggregate: str = "max") -> Gallery:
+        """A gallery over the mapped rows, scanning the codes if there are any.
+
+        Identities with several rows are matched by ``aggregate`` (``max`` or
+        ``mean``, see ``Gallery``).
+        """
+        if self.identity_ids is None:
+            gallery = Gallery(
+                self.ids,
+                self.matrix,
+                normalized=True,
+                digest=self.header["ids_digest"],
+            )
+        else:
+            gallery = Gallery(
+                self.identity_ids,
+                self.matrix,
+                normalized=True,
+                digest=self.header["template_digests"][aggregate],
+                offsets=self.identity_offsets,
+                aggregate=aggregate,
+            )
+        if self.codes is not None:
+            if gallery.matrix is self.matrix:
+                gallery.attach_codes(self.codes, self.code_scales, rerank)
+            else:  # mean templates are new rows
+                codes, scales = encode_rows(gallery.matrix, self.code_kind)
+                gallery.attach_codes(codes, scales, rerank)
+        return gallery
+
+
+def convert_pickle(
+    pickle_path: Path,
+    store_path: Path,
+    model: str,
+    preprocess_version: int = LEGACY_PREPROCESS_VERSION,
+    dtype: str = "float32",
+    codes: str = "none",
+) -> int:
+    """One-shot conversion of a legacy ``{id: embedding}`` pickle to a store.
+
+    The store is stamped with the preprocessing the pickle was built with,
+    so loaders still see that it predates the current version.
+    """
+    with open(pickle_path, "rb") as f:
+        embeddings = pickle.load(f)
+    ids = list(embeddings.keys())
+    matrix = (
+        np.stack([np.asarray(embeddings[i], dtype=np.float32).ravel() for i in ids])
+        if ids
+        else np.zeros((0, 512), dtype=np.float32)
+    )
+    write_store(store_path, ids, matrix, model, preprocess_version, dtype, codes)
+    return len(ids)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embedding store utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="convert a legacy pickle to a store")
+    convert.add_argument("pickle", type=Path, nargs="?", default=LEGACY_PICKLE_PATH)
+    convert.add_argument("store", type=Path, nargs="?", default=STORE_PATH)
+    convert.add_argument("--model", default=None)
+    convert.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    convert.add_argument(
+        "--codes",
+        choices=CODE_KINDS,
+        default="none",
+        help="scan codes; float16 only saves memory and scans slower than float32",
+    )
+    info = sub.add_parser("info", help="print a store header")
+    info.add_argument("store", type=Path, nargs="?", default=STORE_PATH)
+    report = sub.add_parser(
+        "codes", help="memory and top-1 agreement of compact codes vs float32"
+    )
+    report.add_argument("store", type=Path, nargs="?", default=STORE_PATH)
+    report.add_argument("--reranks", type=int, nargs="+", default=[0, 8, 32, 64])
+    report.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        from similarity import DEFAULT_VARIANT
+
+        n = convert_pickle(
+            args.pickle,
+            args.store,
+            args.model or DEFAULT_VARIANT,
+            LEGACY_PREPROCESS_VERSION,
+            args.dtype,
+            args.codes,
+        )
+        print(f"Converted {n} embeddings from {args.pickle} to {args.store}")
+    elif args.command == "codes":
+        codes_report(
+            np.asarray(EmbeddingStore(args.store).matrix, dtype=np.float32),
+            reranks=args.reranks,
+            n_queries=args.queries,
+        )
+    else:
+        print(json.dumps(EmbeddingStore(args.store).header, indent=2))
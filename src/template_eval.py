@@ -0,0 +1,127 @@
+"""Accuracy and search cost of per-identity templates on a local eval set.
+
+The eval set is a directory with one sub-directory of photos per person::
+
+    data/eval/<identity>/<photo>.jpg
+
+Each person's last photo (by name) is the probe and the others are
+enrolled; people with a single photo are enrolled as distractors only.
+Every probe is matched against galleries enrolling only the first photo
+per person (the old one-photo store), all photos with ``max`` aggregation
+and all photos as a ``mean`` template, reporting top-1 accuracy, gallery
+rows scanned and time per query. Without an eval directory a synthetic set
+stands in: each person is a random direction and each photo drifts from it.
+"""
+
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import numpy as np
+
+from gallery import Gallery
+
+EVAL_DIR = Path.cwd() / "data" / "eval"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def embed_eval_set(eval_dir: Path) -> dict[str, np.ndarray]:
+    """``{identity: (n_photos, dim)}`` for every photo with a detected face."""
+    import cv2
+
+    from detection import detect_faces
+    from similarity import DEFAULT_VARIANT, embed_faces, get_edge_model
+
+    model = get_edge_model(DEFAULT_VARIANT)
+    samples = {}
+    for person in sorted(p for p in eval_dir.iterdir() if p.is_dir()):
+        faces = []
+        for path in sorted(person.iterdir()):
+            if not path.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(str(path))
+            detected = detect_faces(image) if image is not None else []
+            if detected:
+                faces.append(detected[0])
+            else:
+                print(f"WARNING: No face detected in {path}. Skipping.")
+        if faces:
+            samples[person.name] = embed_faces(faces, model)
+    return samples
+
+
+def synthetic_eval_set(
+    n_people: int = 2000,
+    photos=(1, 6),
+    dim: int = 512,
+    drift: float = 2.5,
+    seed: int = 0,
+) -> dict[str, np.ndarray]:
+    """People as random unit vectors, photos as noisy copies of them.
+
+    ``drift`` is the noise norm relative to the person vector, so single
+    photos are unreliable and averaging several of them helps.
+    """
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for i in range(n_people):
+        center = rng.normal(size=dim)
+        center /= np.linalg.norm(center)
+        n = int(rng.integers(photos[0], photos[1] + 1))
+        noise = rng.normal(size=(n, dim)) * drift / np.sqrt(dim)
+        samples[f"p{i:05d}"] = (center + noise).astype(np.float32)
+    return samples
+
+
+def _gallery(enrolled: dict[str, np.ndarray], mode: str) -> Gallery:
+    ids = list(enrolled)
+    if mode == "single":
+        return Gallery(ids, np.stack([enrolled[i][0] for i in ids]))
+    counts = [len(enrolled[i]) for i in ids]
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    matrix = np.concatenate([enrolled[i] for i in ids])
+    return Gallery(ids, matrix, offsets=offsets, aggregate=mode)
+
+
+def evaluate(samples: dict[str, np.ndarray], modes=("single", "max", "mean")):
+    """Print top-1 accuracy and search cost of each enrollment mode."""
+    probes = {i: s[-1] for i, s in samples.items() if len(s) > 1}
+    enrolled = {i: s[:-1] if len(s) > 1 else s for i, s in samples.items()}
+    if not probes:
+        print("No person has more than one photo; nothing to evaluate.")
+        return
+    n_photos = sum(len(s) for s in enrolled.values())
+    print(
+        f"{len(enrolled)} people, {n_photos} enrolled photos, "
+        f"{len(probes)} probes"
+    )
+    print(f"{'mode':<8} {'rows':>8} {'top-1':>7} {'ms/query':>9}")
+    for mode in modes:
+        gallery = _gallery(enrolled, mode)
+        hits = 0
+        start = time.perf_counter()
+        for identity, probe in probes.items():
+            hits += gallery.search(probe, 1)[0][0] == identity
+        ms = 1000 * (time.perf_counter() - start) / len(probes)
+        print(
+            f"{mode:<8} {len(gallery.matrix):>8} "
+            f"{hits / len(probes):>7.3f} {ms:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate per-identity templates")
+    parser.add_argument("--eval-dir", type=Path, default=EVAL_DIR)
+    parser.add_argument("--people", type=int, default=2000, help="synthetic set size")
+    parser.add_argument("--drift", type=float, default=2.5, help="synthetic noise")
+    args = parser.parse_args()
+
+    if args.eval_dir.is_dir():
+        eval_samples = embed_eval_set(args.eval_dir)
+    else:
+        print(f"No eval set at {args.eval_dir}; using a synthetic one.")
+        eval_samples = synthetic_eval_set(args.people, drift=args.drift)
+    evaluate(eval_samples)
@@ -0,0 +1,174 @@
+"""Face tracks across captured frames.
+
+Boxes are associated with tracks by IoU, falling back to centroid distance
+for faces that moved further than their size. A track is re-embedded only
+every ``reembed_every`` frames or when its crop visibly changes, and
+matching uses the running mean of its embeddings, so a face that stays in
+view costs one embedding per several frames and single noisy frames are
+averaged out.
+"""
+
+from __future__ import annotations
+
+import cv2
+import numpy as np
+
+IOU_MATCH = 0.3  # minimum IoU to continue a track
+CENTROID_MATCH = 0.5  # max centroid shift as a fraction of the track's box diagonal
+MAX_MISSES = 3  # frames a track survives without a detection
+REEMBED_EVERY = 10  # frames between embeddings of an unchanged track
+MIN_EMBEDDINGS = 2  # embedded every frame until it has this many
+CHANGE_THRESHOLD = 0.12  # mean abs thumbnail difference (0..1) forcing a re-embed
+SWITCH_SIMILARITY = 0.3  # cosine to the mean below which a track restarts
+THUMB_SIZE = 16
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of ``(N, 4)`` and ``(M, 4)`` ``x1, y1, x2, y2`` boxes."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def _thumb(crop: np.ndarray) -> np.ndarray:
+    small = cv2.resize(
+        crop[..., :3], (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA
+    )
+    return small.mean(axis=2, dtype=np.float32) / 255.0
+
+
+class Track:
+    def __init__(self, track_id: int, box, frame: int):
+        self.id = track_id
+        self.box = box
+        self.misses = 0
+        self.frames = 1
+        self.embedded_at = frame
+        self.thumb: np.ndarray | None = None  # crop thumbnail at the last embedding
+        self.n_embeddings = 0
+        self.offender_id: str | None = None  # last match, set by the caller
+        self._sum: np.ndarray | None = None
+
+    @property
+    def mean(self) -> np.ndarray | None:
+        """Mean of the track's L2-normalized embeddings."""
+        return None if self._sum is None else self._sum / self.n_embeddings
+
+    def add_embedding(self, embedding: np.ndarray):
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+        mean = self.mean
+        if mean is not None:
+            cos = float(embedding @ mean) / max(float(np.linalg.norm(mean)), 1e-12)
+            if cos < SWITCH_SIMILARITY:
+                # Most likely a different person took over the box
+                self._sum, self.n_embeddings, self.offender_id = None, 0, None
+        self._sum = embedding if self._sum is None else self._sum + embedding
+        self.n_embeddings += 1
+
+
+class FaceTracker:
+    """Associates per-frame face boxes with tracks and decides what to embed."""
+
+    def __init__(
+        self,
+        reembed_every: int = REEMBED_EVERY,
+        change_threshold: float = CHANGE_THRESHOLD,
+        max_misses: int = MAX_MISSES,
+    ):
+        self.reembed_every = reembed_every
+        self.change_threshold = change_threshold
+        self.max_misses = max_misses
+        self.tracks: list[Track] = []
+        self.frame = 0
+        self.faces = 0
+        self.embedded = 0
+        self._next_id = 0
+
+    def _associate(self, boxes: np.ndarray) -> dict[int, int]:
+        """Greedy box -> track assignment, by IoU then by centroid distance."""
+        if not self.tracks or not len(boxes):
+            return {}
+        prev = np.array([t.box for t in self.tracks], dtype=np.float32)
+        assigned: dict[int, int] = {}
+        used: set[int] = set()
+
+        ious = iou_matrix(boxes, prev)
+        for b, t in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape)):
+            if ious[b, t] < IOU_MATCH:
+                break
+            if b not in assigned and t not in used:
+                assigned[int(b)] = int(t)
+                used.add(int(t))
+
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        prev_centers = (prev[:, :2] + prev[:, 2:]) / 2
+        dist = np.linalg.norm(centers[:, None] - prev_centers[None], axis=2)
+        dist /= np.linalg.norm(prev[:, 2:] - prev[:, :2], axis=1)[None]
+        for b, t in zip(*np.unravel_index(np.argsort(dist, axis=None), dist.shape)):
+            if dist[b, t] > CENTROID_MATCH:
+                break
+            if b not in assigned and t not in used:
+                assigned[int(b)] = int(t)
+                used.add(int(t))
+        return assigned
+
+    def update(self, image: np.ndarray, boxes) -> list[tuple[Track, np.ndarray]]:
+        """Advance one frame; return ``(track, crop)`` for tracks to embed.
+
+        Crops are views into ``image`` and must be used before it changes.
+        """
+        self.frame += 1
+        self.faces += len(boxes)
+        box_arr = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        assigned = self._associate(box_arr)
+
+        to_embed = []
+        seen = set()
+        for b, box in enumerate(boxes):
+            x1, y1, x2, y2 = box
+            crop = image[y1:y2, x1:x2]
+            if b in assigned:
+                track = self.tracks[assigned[b]]
+                track.box, track.misses = box, 0
+                track.frames += 1
+            else:
+                track = Track(self._next_id, box, self.frame)
+                self._next_id += 1
+                self.tracks.append(track)
+            seen.add(track.id)
+
+            thumb = _thumb(crop)
+            due = (
+                track.n_embeddings < MIN_EMBEDDINGS
+                or self.frame - track.embedded_at >= self.reembed_every
+                or track.thumb is None
+                or float(np.abs(thumb - track.thumb).mean()) > self.change_threshold
+            )
+            if due:
+                track.embedded_at, track.thumb = self.frame, thumb
+                to_embed.append((track, crop))
+
+        for track in self.tracks:
+            if track.id not in seen:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        self.embedded += len(to_embed)
+        return to_embed
+
+    def regions(self) -> list[tuple[int, int, int, int]]:
+        """Current track boxes; safe to call from another thread."""
+        return [track.box for track in self.tracks]
+
+    def summary(self) -> str:
+        rate = 100 * self.embedded / self.faces if self.faces else 0.0
+        return (
+            f"Tracker: {len(self.tracks)} active tracks, embedded "
+            f"{self.embedded}/{self.faces} faces ({rate:.1f}%) over {self.frame} frames"
+        )
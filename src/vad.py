@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import numpy as np
+
+RATE = 16_000
+FRAME_MS = 30
+MARGIN_DB = 9.0  # speech must be this far above the noise floor
+ABS_FLOOR_DB = -50.0  # frames below this are never speech
+HANGOVER_MS = 300  # keep this much after speech ends (trailing consonants)
+PAD_MS = 200  # context kept around each speech segment for Whisper
+MIN_SPEECH_MS = 400  # less voiced audio than this is not decoded
+NOISE_ADAPT = 0.1  # EMA rate of the running noise-floor estimate
+
+
+def _dilate(mask: np.ndarray, frames: int) -> np.ndarray:
+    """Extend every True run by ``frames`` on both sides."""
+    if frames <= 0 or not mask.any():
+        return mask
+    kernel = np.ones(2 * frames + 1, dtype=np.int32)
+    return np.convolve(mask.astype(np.int32), kernel, mode="same") > 0
+
+
+class EnergyVAD:
+    """Frame-energy voice activity detector with an adaptive noise floor.
+
+    If ``webrtcvad`` is installed and ``aggressiveness`` is given, its small
+    GMM model makes the per-frame decision instead, which rejects steady
+    background music better than energy alone.
+    """
+
+    def __init__(self, rate: int = RATE, aggressiveness: int | None = None):
+        self.rate = rate
+        self.frame = rate * FRAME_MS // 1000
+        self.noise_db = ABS_FLOOR_DB
+        self.voiced_ms = 0  # unpadded speech in the last segments() call
+        self._webrtc = None
+        if aggressiveness is not None:
+            try:
+                import webrtcvad
+
+                self._webrtc = webrtcvad.Vad(aggressiveness)
+            except ImportError:
+                print("webrtcvad not installed, using the energy VAD")
+
+    def _frame_mask(self, audio: np.ndarray) -> np.ndarray:
+        n = len(audio) // self.frame
+        frames = audio[: n * self.frame].reshape(n, self.frame)
+        if self._webrtc is not None:
+            pcm = (np.clip(frames, -1.0, 1.0) * 32767).astype(np.int16)
+            return np.array(
+                [self._webrtc.is_speech(f.tobytes(), self.rate) for f in pcm],
+                dtype=bool,
+            )
+        rms = np.sqrt(np.einsum("ij,ij->i", frames, frames) / self.frame)
+        db = 20 * np.log10(np.maximum(rms, 1e-10))
+        if n:
+            # The quietest tenth of a window is a good noise sample.
+            quiet = float(np.percentile(db, 10))
+            self.noise_db += NOISE_ADAPT * (quiet - self.noise_db)
+        return db > max(self.noise_db + MARGIN_DB, ABS_FLOOR_DB)
+
+    def segments(self, audio: np.ndarray) -> list[tuple[int, int]]:
+        """Speech ``(start, end)`` sample ranges, padded and merged."""
+        mask = self._frame_mask(audio)
+        self.voiced_ms = int(mask.sum()) * FRAME_MS
+        mask = _dilate(mask, HANGOVER_MS // FRAME_MS)
+        mask = _dilate(mask, PAD_MS // FRAME_MS)
+        padded = np.concatenate([[0], mask, [0]]).astype(np.int8)
+        edges = np.flatnonzero(np.diff(padded))
+        return [
+            (int(a) * self.frame, min(len(audio), int(b) * self.frame))
+            for a, b in zip(edges[::2], edges[1::2])
+        ]
+
+
+class VadStats:
+    """How much audio the VAD kept away from the ASR model."""
+
+    def __init__(self):
+        self.windows = 0
+        self.skipped_windows = 0
+        self.offered = 0
+        self.transcribed = 0
+
+    def record(self, offered: int, transcribed: int):
+        self.windows += 1
+        self.skipped_windows += transcribed == 0
+        self.offered += offered
+        self.transcribed += transcribed
+
+    def summary(self) -> str:
+        skipped = 1 - self.transcribed / self.offered if self.offered else 0.0
+        return (
+            f"VAD skipped {100 * skipped:.1f}% of audio, "
+            f"{self.skipped_windows}/{self.windows} windows entirely"
+        )